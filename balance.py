@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from game.balance import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare ColorMinigame's incremental coverage count against the original
+per-pixel `Surface.get_at` loop.
+
+    $ python3 -m benchmarks.color_ratio
+"""
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from game.minigame import ColorMinigame
+from game.rng import RNG
+
+ROUNDS = 20
+ITEMS_PER_ROUND = 6
+
+
+def legacy_ratio(minigame, circles):
+    """The original implementation, redrawing every circle and scanning."""
+    minigame.surface.fill(minigame.BG)
+    for center, radius in circles:
+        pygame.draw.circle(minigame.surface, minigame.PURPLE, center, radius)
+
+    white = 0
+    purple = 0
+    for y in range(minigame.surface.get_height()):
+        for x in range(minigame.surface.get_width()):
+            if minigame.surface.get_at((x, y)) == minigame.PURPLE:
+                purple += 1
+            else:
+                white += 1
+
+    return purple / white
+
+
+def main():
+    pygame.init()
+    RNG.seed(0)
+
+    enemy = SimpleNamespace(difficulty=1, type="benchmark", pos=(0, 0))
+    minigame = ColorMinigame(enemy)
+
+    incremental = 0
+    legacy = 0
+    for _ in range(ROUNDS):
+        minigame.reset()
+        circles = []
+        for _ in range(ITEMS_PER_ROUND):
+            start = time.perf_counter()
+            minigame.add_item()
+            incremental += time.perf_counter() - start
+
+            # the minigame only keeps the circles it hasn't drawn yet
+            if minigame.item_count == 1:
+                circles = []
+            circles.append(minigame.items[-1])
+
+            start = time.perf_counter()
+            expected = legacy_ratio(minigame, circles)
+            legacy += time.perf_counter() - start
+
+            assert minigame.ratio == expected, (minigame.ratio, expected)
+
+    calls = ROUNDS * ITEMS_PER_ROUND
+    print(f"Surface: {minigame.surface.get_width()} x {minigame.surface.get_height()}")
+    print(f"legacy:      {legacy / calls * 1000:8.3f} ms per add_item")
+    print(f"incremental: {incremental / calls * 1000:8.3f} ms per add_item")
+    print(f"speedup:     {legacy / incremental:8.1f}x")
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Micro-benchmarks for the engine's hot paths, run headless against the real
+code.
+
+    $ python3 -m benchmarks.suite --save results.json
+    $ python3 -m benchmarks.suite --compare results.json --threshold 0.2
+
+With `--compare` the run fails if any benchmark got slower than the
+baseline by more than the threshold (a fraction, 0.2 is 20%).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+from benchmarks.synthetic import generate
+from game.assets import ASSETS, TEXTS, AssetManager
+from game.consts import WINDOW_HEIGHT, WINDOW_WIDTH
+from game.level.level import Level
+from game.minigame import ColorMinigame
+from game.overlay import HUDOverlay, TextOverlay, TorchlightOverlay
+from game.rng import RNG
+
+SMALL_LEVEL = ("levels/001.map", "levels/001.ene")
+# rows and cols of the synthetic levels, and the fraction of their tiles
+# that are entities
+SIZES = {
+    "medium": (128, 0.01),
+    "large": (512, 0.01),
+    "crowded": (512, 0.4),
+}
+# levels that are loaded only once per repeat
+SLOW_SIZES = ("large", "crowded")
+
+BENCHMARKS = {}
+
+
+def benchmark(name, number=100):
+    """
+    Register a benchmark. The decorated function gets the shared context,
+    does its setup and returns the callable to time, which is called
+    `number` times per repeat.
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+
+    return register
+
+
+def _level(context, size):
+    return Level(*context.levels[size])
+
+
+for _size in ("small", *SIZES):
+
+    @benchmark(f"level.load[{_size}]", number=1 if _size in SLOW_SIZES else 5)
+    def _bench_level_load(context, size=_size):
+        return lambda: Level(*context.levels[size])
+
+    @benchmark(f"level.load_map[{_size}]", number=1 if _size in SLOW_SIZES else 5)
+    def _bench_load_map(context, size=_size):
+        level = _level(context, size)
+
+        def run():
+            # start from the empty state `Level.__init__` loads the map into
+            level.tiles = None
+            level.entities = {}
+            level.player = None
+            level.enemy_count = 0
+            level.max_enemies = 0
+            level._load_map(context.levels[size][0])
+
+        return run
+
+    @benchmark(f"level.render[{_size}]")
+    def _bench_level_render(context, size=_size):
+        level = _level(context, size)
+        level.render(context.screen, bob=False)
+        return lambda: level.render(context.screen, bob=False)
+
+
+@benchmark("torchlight.generate", number=10000)
+def _bench_torchlight_generate(context):
+    return TorchlightOverlay(_level(context, "small")).generate
+
+
+@benchmark("torchlight.render[cached]", number=1000)
+def _bench_torchlight_render(context):
+    overlay = TorchlightOverlay(_level(context, "small"))
+    overlay.render(context.screen)
+    return lambda: overlay.render(context.screen)
+
+
+@benchmark("torchlight.render[flicker]")
+def _bench_torchlight_flicker(context):
+    overlay = TorchlightOverlay(_level(context, "small"))
+    overlay.render(context.screen)
+
+    def run():
+        overlay.generate()
+        overlay.render(context.screen)
+
+    return run
+
+
+@benchmark("text_overlay.render")
+def _bench_text_overlay(context):
+    overlay = TextOverlay()
+    overlay.set_text(TEXTS.get_text("intro"))
+    return lambda: overlay.render(context.screen)
+
+
+@benchmark("hud_overlay.render", number=1000)
+def _bench_hud_overlay(context):
+    overlay = HUDOverlay(_level(context, "small"))
+    return lambda: overlay.render(context.screen)
+
+
+def _color_minigame(items):
+    RNG.seed(0)
+    enemy = SimpleNamespace(difficulty=1, type="benchmark", pos=(0, 0))
+    minigame = ColorMinigame(enemy)
+    for _ in range(items):
+        minigame.add_item()
+    return minigame
+
+
+@benchmark("color_minigame.calculate_ratio", number=10000)
+def _bench_calculate_ratio(context):
+    return _color_minigame(6)._calculate_ratio
+
+
+@benchmark("color_minigame.add_item", number=1000)
+def _bench_add_item(context):
+    minigame = _color_minigame(0)
+
+    def run():
+        if minigame.item_count >= 6:
+            minigame.reset()
+        minigame.add_item()
+
+    return run
+
+
+@benchmark("assets.build[cached]", number=5)
+def _bench_assets_build(context):
+    AssetManager().build()
+    return lambda: AssetManager().build()
+
+
+@benchmark("assets.build_atlas", number=5)
+def _bench_build_atlas(context):
+    return AssetManager()._build_atlas
+
+
+def run(names, repeat):
+    pygame.init()
+    RNG.seed(0)
+    context = SimpleNamespace(
+        screen=pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT)),
+        levels={"small": SMALL_LEVEL},
+    )
+    ASSETS.build()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size, (tiles, entities) in SIZES.items():
+            context.levels[size] = generate(
+                os.path.join(tmp, size), tiles, tiles, entities=entities
+            )
+
+        for name in names:
+            setup, number = BENCHMARKS[name]
+            func = setup(context)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for _ in range(number):
+                    func()
+                times.append((time.perf_counter() - start) / number)
+
+            results[name] = {
+                "median": statistics.median(times),
+                "min": min(times),
+                "number": number,
+                "repeat": repeat,
+            }
+            print(
+                f"{name:<36} {results[name]['median'] * 1e6:12.1f} us "
+                f"(min {results[name]['min'] * 1e6:.1f} us)"
+            )
+
+    pygame.quit()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against `baseline` and return the regressed names."""
+    regressions = []
+    print(f"\n{'benchmark':<36} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median"]
+        change = result["median"] / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<36} {before * 1e6:9.1f} us {result['median'] * 1e6:9.1f} us "
+            f"{change:+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the engine benchmarks.")
+    parser.add_argument("-k", dest="filter", default="", help="only names with this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run(names, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "pygame": pygame.version.ver,
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Generate synthetic levels of any size to measure how costs scale with the
+size of the map.
+
+    $ python3 -m benchmarks.synthetic levels/big 512 512 --walls 0.3 --entities 0.02
+
+writes levels/big.map and levels/big.ene.
+"""
+import argparse
+import random
+
+from game.level.types import EntityType, TileType
+
+# entity types scattered over the map, the player and the exit are placed
+# once each
+SCATTERED = (
+    EntityType.ENEMY,
+    EntityType.COFFEE,
+    EntityType.SIGN,
+    EntityType.TREE,
+    EntityType.KEY,
+    EntityType.DOOR,
+)
+MINIGAMES = "pfc"
+
+
+def generate(basename, rows, cols, walls=0.25, entities=0.01, seed=0):
+    """
+    Write `basename`.map and `basename`.ene for a `rows` x `cols` level
+    surrounded by walls. `walls` and `entities` are the fractions of inner
+    tiles that are walls and entities. Returns the two filenames.
+    """
+    if rows < 3 or cols < 3:
+        raise ValueError("A level needs at least 3 x 3 tiles")
+
+    rng = random.Random(seed)
+    grid = [[TileType.WALL.value] * cols for _ in range(rows)]
+    inner = [(row, col) for row in range(1, rows - 1) for col in range(1, cols - 1)]
+    for row, col in inner:
+        grid[row][col] = (
+            TileType.WALL.value if rng.random() < walls else TileType.GROUND.value
+        )
+
+    rng.shuffle(inner)
+    player, win, *rest = inner
+    grid[player[0]][player[1]] = EntityType.PLAYER.value
+    grid[win[0]][win[1]] = EntityType.WIN.value
+    for row, col in rest[: int(len(inner) * entities)]:
+        grid[row][col] = rng.choice(SCATTERED).value
+
+    map_filename = f"{basename}.map"
+    with open(map_filename, "w") as map_file:
+        for line in grid:
+            map_file.write("".join(str(code) for code in line) + "\n")
+
+    # enemy properties are read in row-major order of the enemies
+    enemies = sum(line.count(EntityType.ENEMY.value) for line in grid)
+    enemies_filename = f"{basename}.ene"
+    with open(enemies_filename, "w") as enemies_file:
+        for _ in range(enemies):
+            difficulty = rng.randint(1, 9)
+            health = rng.randint(1, 6)
+            enemies_file.write(f"{difficulty} {health} {rng.choice(MINIGAMES)}\n")
+
+    return map_filename, enemies_filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic level.")
+    parser.add_argument("basename")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("cols", type=int)
+    parser.add_argument("--walls", type=float, default=0.25)
+    parser.add_argument("--entities", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for filename in generate(
+        args.basename, args.rows, args.cols, args.walls, args.entities, args.seed
+    ):
+        print(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+#!/usr/bin/env python3
+from game.level.compiled import main
+
+main()
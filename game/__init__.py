@@ -1 +1,4 @@
-from game.main import run
+from game.startup import STARTUP
+
+with STARTUP.phase("import"):
+    from game.main import run
@@ -1,10 +1,17 @@
+import collections
+import hashlib
 import logging
+import os
 import random
+import threading
 
 import pygame
 
 from game.consts import ENTITY_SIZE_PIXELS, TILE_SIZE_PIXELS
 from game.level.types import EntityType, TileType
+from game.rng import RNG
+from game.startup import STARTUP
+from game.tracing import TRACER
 
 logger = logging.getLogger(__name__)
 
@@ -38,35 +45,110 @@ class AssetManager:
         "tiles": TILE_SIZE_PIXELS,
     }
     ORIGINAL_SIZE = 16
+    CACHE_DIR = os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "hackweek-dungeon-crawler",
+    )
 
-    def __init__(self):
+    def __init__(self, seed=None):
+        self.atlas = None
+        self.sprites = {}
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Make variant selection reproducible. Sprites picked by position
+        only depend on the seed, the rest on the order of `load` calls.
+        Without a seed, variants are picked with the game's `RNG`.
+        """
+        self.random = random.Random(seed) if seed is not None else None
+        self._variant_seed = seed
+        self._derived = None
+
+    @property
+    def variant_seed(self):
+        if self._variant_seed is not None:
+            return self._variant_seed
+        # derived once per RNG seed, every entity of a level asks for it
+        if self._derived is None or self._derived[0] != RNG.value:
+            self._derived = (RNG.value, RNG.derive("variants"))
+        return self._derived[1]
+
+    def build(self):
+        """
+        Load the sprite atlas from the on-disk cache, or build and cache it,
+        and slice every sprite variant out of it. Call this after the
+        display mode has been set so the atlas matches the display format.
+        """
+        with open(self.FILENAME, "rb") as tileset_file:
+            digest = hashlib.sha1(tileset_file.read()).hexdigest()[:16]
+        sizes = "-".join(f"{size}" for size in self.SIZES.values())
+        path = os.path.join(self.CACHE_DIR, f"atlas-{digest}-{sizes}.png")
+
+        try:
+            atlas = pygame.image.load(path)
+            logger.debug("Loaded sprite atlas from %s", path)
+        except (OSError, pygame.error):
+            atlas = self._build_atlas()
+            try:
+                os.makedirs(self.CACHE_DIR, exist_ok=True)
+                pygame.image.save(atlas, path)
+                logger.debug("Saved sprite atlas to %s", path)
+            except (OSError, pygame.error) as e:
+                logger.warning("Could not cache sprite atlas: %s", e)
+
+        if pygame.display.get_surface() is not None:
+            atlas = atlas.convert_alpha()
+        self.atlas = atlas
+
+        cols = atlas.get_width() // sum(self.SIZES.values())
+        left = 0
+        for category, size in self.SIZES.items():
+            for type_, options in self.MAPPING[category].items():
+                self.sprites[(category, type_)] = [
+                    atlas.subsurface(left, option * size, size, size)
+                    for option in options
+                ]
+            left += size * cols
+
+    def variants(self, category, type_):
+        """All sprites of the given type. The sprites are shared."""
+        if self.atlas is None:
+            self.build()
+        return self.sprites[(category, type_)]
+
+    def load(self, category, type_, pos=None):
+        options = self.variants(category, type_)
+        if pos is None:
+            return (self.random or RNG.stream("assets")).choice(options)
+        return options[hash((self.variant_seed, *pos)) % len(options)]
+
+    def _build_atlas(self):
+        """Scale the tileset once per category, side by side, with alpha."""
         original_tileset = pygame.image.load(self.FILENAME)
         rows = original_tileset.get_height() // self.ORIGINAL_SIZE
         cols = original_tileset.get_width() // self.ORIGINAL_SIZE
 
-        self.tileset = {
-            category: pygame.transform.scale(
-                original_tileset,
-                (self.SIZES[category] * cols, self.SIZES[category] * rows),
-            )
-            for category in self.SIZES.keys()
-        }
-
-    def load(self, category, type_):
-        options = self.MAPPING[category][type_]
-
-        size = self.SIZES[category]
-        asset = self.tileset[category].subsurface(
-            0,
-            random.choice(options) * size,
-            size,
-            size,
+        atlas = pygame.Surface(
+            (
+                sum(self.SIZES.values()) * cols,
+                max(self.SIZES.values()) * rows,
+            ),
+            pygame.SRCALPHA,
         )
-        return asset
+        left = 0
+        for size in self.SIZES.values():
+            atlas.blit(
+                pygame.transform.scale(original_tileset, (size * cols, size * rows)),
+                (left, 0),
+            )
+            left += size * cols
+        return atlas
 
 
 class TextManager:
     FONT_FILENAME = "assets/m5x7.ttf"
+    MAX_RENDERED = 256
 
     FILENAMES = {
         "intro": "text/intro.txt",
@@ -87,36 +169,132 @@ class TextManager:
 
     def __init__(self):
         self.text = {}
+        self.unused = {}
+        # levels are built on a worker thread, see `pool`
+        self.lock = threading.Lock()
+        self.fonts = {}
+        self.rendered = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-        for category, filename in self.FILENAMES.items():
-            with open(filename) as text_file:
-                contents = "".join(text_file.readlines())
-                if category in self.SPLIT:
-                    contents = contents.split("\n\n")
-                    contents.reverse()
-                else:
-                    contents = [contents]
-                self.text[category] = [c.strip() for c in contents]
+    def load(self, category):
+        """Read the texts of a category. Done on first use if not earlier."""
+        with open(self.FILENAMES[category]) as text_file:
+            contents = "".join(text_file.readlines())
+            if category in self.SPLIT:
+                contents = contents.split("\n\n")
+                contents.reverse()
+            else:
+                contents = [contents]
+            self.text[category] = [c.strip() for c in contents]
+            self.unused[category] = list(self.text[category])
 
     def get_font(self, size):
-        return pygame.font.Font(self.FONT_FILENAME, size)
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.Font(self.FONT_FILENAME, size)
+        return self.fonts[size]
+
+    def render(self, text, size, color, antialias=False):
+        """
+        Render a line of text, reusing the surface from an earlier call with
+        the same arguments. The returned surface is shared, don't draw on it.
+        """
+        key = (text, size, color, antialias)
+        if key in self.rendered:
+            self.hits += 1
+            self.rendered.move_to_end(key)
+            return self.rendered[key]
+
+        self.misses += 1
+        surface = self.get_font(size).render(text, antialias, color)
+        TRACER.count("surfaces")
+        self.rendered[key] = surface
+        if len(self.rendered) > self.MAX_RENDERED:
+            self.rendered.popitem(last=False)
+        return surface
+
+    def texts(self, category):
+        """All texts of a category, read on first use."""
+        with self.lock:
+            if category not in self.text:
+                self.load(category)
+        return self.text[category]
+
+    def pool(self, rng):
+        """A `TextPool` handing out texts in an order drawn from `rng`."""
+        return TextPool(self, rng)
 
     def get_text(self, category, exhaust=True):
+        self.texts(category)
+
         if exhaust:
-            return self.text[category].pop()
+            # start over once every text has been used
+            if not self.unused[category]:
+                self.unused[category] = list(self.text[category])
+            return self.unused[category].pop()
         else:
-            return random.choice(self.text[category])
+            return RNG.stream("texts").choice(self.text[category])
+
+
+class TextPool:
+    """
+    Texts for the entities of one level. Every text of a category is used
+    once, in an order shuffled with the level's own `rng`, before any is
+    used again. Levels built in the background draw from their own pool,
+    not from the shared `TEXTS`.
+    """
+
+    def __init__(self, texts, rng):
+        self.texts = texts
+        self.rng = rng
+        self.unused = {}
+
+    def get_text(self, category):
+        if not self.unused.get(category):
+            unused = list(self.texts.texts(category))
+            self.rng.shuffle(unused)
+            self.unused[category] = unused
+        return self.unused[category].pop()
 
 
 class SoundManager:
     MUSIC_FILENAME = "assets/the-introvert-michael-kobrin-10959.mp3"
 
     def __init__(self):
-        pygame.mixer.init()
-        self.music = pygame.mixer.music.load(self.MUSIC_FILENAME)
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.ready = False
+        self.play_requested = False
+
+    def load(self):
+        """Initialize the mixer and load the music. Slow, see `load_async`."""
+        with STARTUP.phase("audio"):
+            try:
+                pygame.mixer.init()
+                pygame.mixer.music.load(self.MUSIC_FILENAME)
+                self.ready = True
+            except (OSError, pygame.error) as e:
+                logger.warning("Music disabled: %s", e)
+
+        with self.lock:
+            self.loaded = True
+            if self.play_requested:
+                self._play()
+
+    def load_async(self):
+        threading.Thread(target=self.load, name="audio", daemon=True).start()
 
     def play(self):
-        pygame.mixer.music.play(loops=-1)
+        """Start the music, or start it as soon as it has been loaded."""
+        with self.lock:
+            if self.loaded:
+                self._play()
+            else:
+                self.play_requested = True
+
+    def _play(self):
+        if self.ready:
+            pygame.mixer.music.play(loops=-1)
 
 
 ASSETS = AssetManager()
@@ -0,0 +1,414 @@
+import argparse
+import concurrent.futures
+import csv
+import glob
+import itertools
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+
+import pygame
+
+from game.assets import ASSETS
+from game.headless import HeadlessEngine
+from game.level.entity import Player
+from game.level.level import Level, read_enemy_props
+from game.main import FPS, Game, State
+from game.minigame import ColorMinigame, FlashMinigame, PrecisionMinigame
+from game.rng import RNG
+
+logger = logging.getLogger(__name__)
+
+# the player stands right next to the enemy, in a walled in corridor
+ARENA_MAP = "1111\n1341\n1111\n"
+DEFAULT_MODELS = ("novice=350,120,0.8", "casual=250,80,0.9", "expert=180,40,0.98")
+# fights still going after five minutes of game time are given up on
+MAX_TICKS = FPS * 60 * 5
+
+
+class PlayerModel:
+    """
+    Simulated human playing minigames.
+
+    The player notices a cue, which is the purple flash, the purple area
+    winning, or in the precision minigame the bar being `reaction_ms` away
+    from the middle of the target, and presses `reaction_ms` later, give or
+    take a normally distributed `jitter_ms`. Every cue is acted on with
+    probability `accuracy` and missed otherwise.
+    """
+
+    def __init__(self, name, reaction_ms, jitter_ms, accuracy):
+        self.name = name
+        self.reaction_ms = reaction_ms
+        self.jitter_ms = jitter_ms
+        self.accuracy = accuracy
+
+    def __str__(self):
+        return f"{self.name}={self.reaction_ms:g},{self.jitter_ms:g},{self.accuracy:g}"
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a `name=reaction_ms,jitter_ms,accuracy` spec."""
+        name, _, params = spec.partition("=")
+        try:
+            reaction_ms, jitter_ms, accuracy = (float(p) for p in params.split(","))
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"Bad player model {spec!r}, expected name=reaction,jitter,accuracy"
+            )
+        return cls(name, reaction_ms, jitter_ms, accuracy)
+
+
+class ModelledPlayer:
+    """A `PlayerModel` fighting one enemy, deciding tick by tick."""
+
+    def __init__(self, model, rng):
+        self.model = model
+        self.rng = rng
+        self.reaction_ticks = model.reaction_ms / HeadlessEngine.TICK_MILLIS
+        self.ticks = 0
+        self.cued = False
+        self.press_at = None
+        self.last_pos = None
+
+    def act(self, minigame):
+        """Whether to press a key on this tick."""
+        self.ticks += 1
+        cued = self._cue(minigame)
+        noticed = cued and not self.cued
+        self.cued = cued
+
+        if self.press_at is not None:
+            if self.ticks < self.press_at:
+                return False
+            self.press_at = None
+            return True
+
+        if noticed and self.rng.random() < self.model.accuracy:
+            delay = self.rng.gauss(self.model.reaction_ms, self.model.jitter_ms)
+            self.press_at = self.ticks + max(
+                round(delay / HeadlessEngine.TICK_MILLIS), 0
+            )
+        return False
+
+    def _cue(self, minigame):
+        if isinstance(minigame, FlashMinigame):
+            return minigame.active_timer > 0
+
+        if isinstance(minigame, ColorMinigame):
+            return minigame.ratio > 1
+
+        if isinstance(minigame, PrecisionMinigame):
+            return self._bar_due(minigame)
+
+        return False
+
+    def _bar_due(self, minigame):
+        """Whether the bar reaches the target's middle within the reaction time."""
+        # the speed is read off the bar's movement, as a player would
+        width = minigame.surface_width
+        last_pos, self.last_pos = self.last_pos, minigame.pos
+        if last_pos is None:
+            return False
+        speed = (minigame.pos - last_pos) % width
+        # a reset moves the bar to a random position
+        if not 0 < speed < width // 4:
+            return False
+
+        middle = (width - minigame.target_width) // 2 + minigame.target_width / 2
+        return (middle - minigame.pos) % width / speed <= self.reaction_ticks
+
+
+class Fight:
+    """
+    Outcome counts of many fights against one kind of enemy, mergeable
+    across worker processes.
+    """
+
+    def __init__(self, rounds=0, wins=0, timeouts=0, damage=0, ticks=0):
+        self.rounds = rounds
+        self.wins = wins
+        self.timeouts = timeouts
+        self.damage = damage
+        self.ticks = ticks
+
+    def __iadd__(self, other):
+        self.rounds += other.rounds
+        self.wins += other.wins
+        self.timeouts += other.timeouts
+        self.damage += other.damage
+        self.ticks += other.ticks
+        return self
+
+    @property
+    def win_rate(self):
+        return self.wins / self.rounds
+
+    @property
+    def expected_damage(self):
+        return self.damage / self.rounds
+
+    @property
+    def error(self):
+        """Standard error of the win rate."""
+        rate = self.win_rate
+        return math.sqrt(rate * (1 - rate) / self.rounds)
+
+
+def write_arena(directory, enemy):
+    """Write a level with the player next to `enemy` and return its files."""
+    difficulty, health, minigame = enemy
+    basename = os.path.join(directory, f"arena_{difficulty}_{health}_{minigame}")
+    with open(f"{basename}.map", "w") as map_file:
+        map_file.write(ARENA_MAP)
+    with open(f"{basename}.ene", "w") as enemies_file:
+        enemies_file.write(f"{difficulty} {health} {minigame}\n")
+    return f"{basename}.map", f"{basename}.ene"
+
+
+class Arena:
+    """
+    A real `Game` with the player standing next to an enemy, built once and
+    set up again for every fight.
+
+    Fights run through the game's own event handlers and the minigame's own
+    `update` and `input`, only the player, the enemy, the minigame and the
+    game state are reset in between.
+    """
+
+    def __init__(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.engine = HeadlessEngine(Game(*write_arena(tmp, (1, 1, "p"))))
+        # show and dismiss the intro once, fights start without it
+        for keys in ([], [pygame.K_SPACE]):
+            self.engine.tick(keys)
+        self.game = self.engine.game
+        self.level = self.game.level
+        self.player = self.level.player
+        self.start = self.player.pos
+        (self.enemy,) = self.level.entities.values()
+
+    def fight(self, enemy, model, seed, max_ticks):
+        """Play one fight against `enemy` and return its `Fight`."""
+        self._reset(enemy, seed)
+        engine = self.engine
+        game = self.game
+        player = ModelledPlayer(model, RNG.stream("player"))
+
+        # walk into the enemy and dismiss its text
+        for key in (pygame.K_RIGHT, pygame.K_SPACE):
+            engine.tick([key])
+        if game.state != State.MINIGAME:
+            raise RuntimeError(f"Fight didn't start, the game is in {game.state.name}")
+
+        while game.state == State.MINIGAME and engine.ticks < max_ticks:
+            engine.tick([pygame.K_SPACE] if player.act(game.minigame) else [])
+
+        return Fight(
+            rounds=1,
+            wins=int(self.level.enemy_count == 0),
+            timeouts=int(game.state == State.MINIGAME),
+            damage=Player.MAX_HEALTH - self.player.health,
+            ticks=engine.ticks,
+        )
+
+    def _reset(self, enemy, seed):
+        RNG.seed(seed)
+        difficulty, health, minigame = enemy
+
+        self.player.row, self.player.col = self.start
+        self.player.replenish_health()
+        self.player.invulnerable = False
+        self.player.inventory.clear()
+
+        self.enemy.reset()
+        self.enemy.set_properties(difficulty, health, Level.MINIGAMES[minigame])
+        if self.enemy.pos not in self.level.entities:
+            self.level.entities[self.enemy.pos] = self.enemy
+            self.level.index.add(self.enemy)
+        self.level.enemy_count = 1
+
+        self.game.state = State.RUNNING
+        self.game.minigame = None
+        self.game.text_overlay.dismiss()
+        self.game.start(intro=False)
+        self.engine.ticks = 0
+
+
+# the arena of a worker process, built by `_init_worker`
+_arena = None
+
+
+def _init_worker():
+    global _arena
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    logging.getLogger().setLevel(logging.WARNING)
+    pygame.init()
+    ASSETS.build()
+    _arena = Arena()
+
+
+def _simulate(enemy, model, seeds, max_ticks):
+    outcome = Fight()
+    for seed in seeds:
+        outcome += _arena.fight(enemy, model, seed, max_ticks)
+    return outcome
+
+
+def round_seed(seed, enemy, model, index):
+    """Seed of one round, the same however rounds are split into batches."""
+    return random.Random(f"{seed}:{enemy}:{model.name}:{index}").getrandbits(32)
+
+
+def simulate(
+    enemies, models, rounds, seed=0, batch=250, workers=None, max_ticks=MAX_TICKS
+):
+    """
+    Fight every enemy `rounds` times with every player model, spread over a
+    process pool, and return a {(enemy, model name): Fight} dict.
+    """
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker
+    ) as pool:
+        futures = {}
+        for enemy, model in itertools.product(enemies, models):
+            results[(enemy, model.name)] = Fight()
+            for first in range(0, rounds, batch):
+                seeds = [
+                    round_seed(seed, enemy, model, index)
+                    for index in range(first, min(first + batch, rounds))
+                ]
+                future = pool.submit(_simulate, enemy, model, seeds, max_ticks)
+                futures[future] = (enemy, model.name)
+
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] += future.result()
+
+    return results
+
+
+def read_enemies(filenames):
+    """Distinct (difficulty, health, minigame) triples of `.ene` files."""
+    return sorted(
+        {enemy for filename in filenames for enemy in read_enemy_props(filename)}
+    )
+
+
+def report(results, enemies, models):
+    header = f"{'minigame':<10}{'diff':>5}{'health':>7}"
+    for model in models:
+        header += f"  {model.name + ' win':>14}{'dmg':>6}"
+    lines = [header]
+
+    for enemy in enemies:
+        difficulty, health, minigame = enemy
+        name = Level.MINIGAMES[minigame].__name__.removesuffix("Minigame")
+        line = f"{name:<10}{difficulty:>5}{health:>7}"
+        for model in models:
+            outcome = results[(enemy, model.name)]
+            line += f"  {outcome.win_rate:>8.1%} ±{outcome.error:>4.1%}"
+            line += f"{outcome.expected_damage:>6.2f}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def write_csv(path, results):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "difficulty",
+                "health",
+                "minigame",
+                "model",
+                "rounds",
+                "win_rate",
+                "expected_damage",
+                "timeouts",
+                "mean_ticks",
+            ]
+        )
+        for ((difficulty, health, minigame), model), outcome in sorted(
+            results.items()
+        ):
+            writer.writerow(
+                [
+                    difficulty,
+                    health,
+                    minigame,
+                    model,
+                    outcome.rounds,
+                    f"{outcome.win_rate:.4f}",
+                    f"{outcome.expected_damage:.4f}",
+                    outcome.timeouts,
+                    f"{outcome.ticks / outcome.rounds:.1f}",
+                ]
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Estimate how hard enemies are by simulating fights against "
+        "them with modelled players, on all cores."
+    )
+    parser.add_argument(
+        "enemies",
+        nargs="*",
+        help=".ene files whose enemies to simulate, defaults to levels/*.ene",
+    )
+    parser.add_argument(
+        "--grid",
+        nargs=3,
+        metavar=("DIFFICULTIES", "HEALTHS", "MINIGAMES"),
+        help="simulate every combination instead, e.g. 1-9 1-6 pfc",
+    )
+    parser.add_argument(
+        "--model",
+        dest="models",
+        action="append",
+        type=PlayerModel.parse,
+        help="name=reaction_ms,jitter_ms,accuracy, can be repeated "
+        f"(default: {' '.join(DEFAULT_MODELS)})",
+    )
+    parser.add_argument("--rounds", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=250)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", metavar="PATH")
+    args = parser.parse_args()
+
+    models = args.models or [PlayerModel.parse(spec) for spec in DEFAULT_MODELS]
+    if args.grid:
+        difficulties, healths, minigames = args.grid
+        enemies = list(
+            itertools.product(_range(difficulties), _range(healths), minigames)
+        )
+    else:
+        enemies = read_enemies(args.enemies or sorted(glob.glob("levels/*.ene")))
+
+    start = time.perf_counter()
+    results = simulate(
+        enemies, models, args.rounds, args.seed, args.batch, args.workers
+    )
+    elapsed = time.perf_counter() - start
+
+    print(report(results, enemies, models))
+    fights = sum(outcome.rounds for outcome in results.values())
+    timeouts = sum(outcome.timeouts for outcome in results.values())
+    print(f"Fights: {fights} in {elapsed:.1f} s ({fights / elapsed:.0f}/s)")
+    if timeouts:
+        print(f"Timed out: {timeouts}")
+    if args.csv:
+        write_csv(args.csv, results)
+
+
+def _range(spec):
+    """Parse `3` or `1-9` into a list of ints."""
+    first, _, last = spec.partition("-")
+    return list(range(int(first), int(last or first) + 1))
@@ -0,0 +1,120 @@
+import collections
+import logging
+
+import pygame
+
+from game.controls import Direction
+from game.level.types import EntityType, ItemType
+from game.main import State
+from game.minigame import ColorMinigame, FlashMinigame, PrecisionMinigame
+
+logger = logging.getLogger(__name__)
+
+
+class Bot:
+    """
+    Scripted player that clears a level by walking towards the exit,
+    fighting whatever is in the way and picking up keys for doors.
+
+    It peeks at game state directly instead of looking at the screen, so it
+    works with rendering disabled.
+    """
+
+    KEYS = {
+        Direction.UP: pygame.K_UP,
+        Direction.RIGHT: pygame.K_RIGHT,
+        Direction.DOWN: pygame.K_DOWN,
+        Direction.LEFT: pygame.K_LEFT,
+    }
+    VECTORS = {
+        Direction.UP: (-1, 0),
+        Direction.RIGHT: (0, 1),
+        Direction.DOWN: (1, 0),
+        Direction.LEFT: (0, -1),
+    }
+    # ticks to wait after pressing a key in a minigame so the result of the
+    # press is processed before pressing again
+    MINIGAME_COOLDOWN = 5
+
+    def __init__(self, game):
+        self.game = game
+        self.cooldown = 0
+
+    def act(self):
+        """Return the key to press on this tick, or None."""
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return None
+
+        if self.game.state == State.OVERLAY:
+            return pygame.K_SPACE
+
+        if self.game.state == State.MINIGAME:
+            if self._should_press(self.game.minigame):
+                self.cooldown = self.MINIGAME_COOLDOWN
+                return pygame.K_SPACE
+            return None
+
+        if self.game.state == State.RUNNING:
+            direction = self._next_step()
+            if direction is not None:
+                return self.KEYS[direction]
+
+        return None
+
+    def _should_press(self, minigame):
+        if isinstance(minigame, PrecisionMinigame):
+            left = (minigame.surface_width - minigame.target_width) // 2
+            return left < minigame.pos < left + minigame.target_width
+
+        if isinstance(minigame, FlashMinigame):
+            return minigame.active_timer > 1
+
+        if isinstance(minigame, ColorMinigame):
+            return minigame.ratio > 1
+
+        return False
+
+    def _passable(self, entity):
+        if entity is None:
+            return True
+        if entity.type in (EntityType.ENEMY, EntityType.KEY, EntityType.COFFEE):
+            return True
+        if entity.type == EntityType.DOOR:
+            return ItemType.KEY in self.game.level.player.inventory
+        return False
+
+    def _next_step(self):
+        """First step of the shortest path to the nearest goal."""
+        level = self.game.level
+        has_key = ItemType.KEY in level.player.inventory
+        goals = {
+            pos
+            for pos, entity in level.entities.items()
+            if entity.type == EntityType.WIN
+            or (entity.type == EntityType.KEY and not has_key)
+        }
+
+        start = level.player.pos
+        first_steps = {start: None}
+        queue = collections.deque([start])
+        while queue:
+            pos = queue.popleft()
+            if pos in goals:
+                return first_steps[pos]
+
+            for direction, (d_row, d_col) in self.VECTORS.items():
+                target = (pos[0] + d_row, pos[1] + d_col)
+                if target in first_steps or not level.walkable(*target):
+                    continue
+                # entities other than the goal need to be cleared before
+                # they can be walked through
+                if target not in goals and not self._passable(
+                    level.entities.get(target)
+                ):
+                    continue
+                first_steps[target] = first_steps[pos] or direction
+                queue.append(target)
+
+        logger.warning("No path to any goal from %d %d", *start)
+        return None
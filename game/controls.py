@@ -22,3 +22,9 @@ MOVEMENT_CONTROLS = {
 }
 
 CONTROLS = MOVEMENT_CONTROLS
+
+# toggles the performance overlay
+PERF_KEY = pygame.K_F3
+
+# writes the frame trace, when tracing is enabled
+TRACE_KEY = pygame.K_F9
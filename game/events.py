@@ -1,4 +1,6 @@
+import collections
 import enum
+import time
 
 import pygame
 
@@ -20,3 +22,91 @@ class CustomEvent(enum.Enum):
     ENTITY_BOB = pygame.USEREVENT + 13
     COLOR_MINIGAME_ADD_ITEM = pygame.USEREVENT + 14
     IFRAMES_DONE = pygame.USEREVENT + 15
+
+
+class EventBus:
+    """
+    In-process queue for game events, with handlers looked up by event type
+    and, optionally, by game state.
+
+    Events posted during a tick are delivered together by `deliver`, usually
+    once per tick. The SDL event queue is left to OS input, which is handed
+    to `dispatch` directly.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, state=None):
+        """
+        Drop all queued events, handlers and statistics. `state` returns the
+        current game state for state specific handlers.
+        """
+        self.queue = []
+        self.handlers = {}
+        self.state = state or (lambda: None)
+        self.counts = collections.Counter()
+        # handler -> [calls, total seconds, max seconds]
+        self.latency = collections.defaultdict(lambda: [0, 0.0, 0.0])
+
+    def subscribe(self, event_type, handler, state=None):
+        """
+        Call `handler(event)` for events of `event_type`, a `CustomEvent` or a
+        pygame event type. With `state`, only while the game is in that state.
+        """
+        key = (getattr(event_type, "value", event_type), state)
+        self.handlers.setdefault(key, []).append(handler)
+
+    def post(self, custom_event, **kwargs):
+        self.queue.append(pygame.event.Event(custom_event.value, **kwargs))
+
+    def deliver(self):
+        """Dispatch the events queued so far and return how many there were."""
+        batch, self.queue = self.queue, []
+        for event in batch:
+            self.dispatch(event)
+        return len(batch)
+
+    def dispatch(self, event):
+        self.counts[event.type] += 1
+
+        # state specific handlers see the state left by the generic ones
+        self._call(self.handlers.get((event.type, None)), event)
+        self._call(self.handlers.get((event.type, self.state())), event)
+
+    def report(self):
+        lines = ["Events:"]
+        for event_type, count in self.counts.most_common():
+            try:
+                name = CustomEvent(event_type).name
+            except ValueError:
+                name = pygame.event.event_name(event_type)
+            lines.append(f"  {name:<24} {count:8d}")
+
+        lines.append("Handlers:")
+        for name, (calls, total, longest) in sorted(
+            self.latency.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                f"  {name:<36} {calls:8d} calls {total / calls * 1e6:8.1f} us avg "
+                f"{longest * 1e6:8.1f} us max"
+            )
+        return "\n".join(lines)
+
+    def _call(self, handlers, event):
+        if not handlers:
+            return
+
+        for handler in handlers:
+            start = time.perf_counter()
+            handler(event)
+            elapsed = time.perf_counter() - start
+
+            stats = self.latency[handler.__qualname__]
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+
+BUS = EventBus()
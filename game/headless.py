@@ -0,0 +1,199 @@
+import argparse
+import logging
+import time
+
+import pygame
+
+from game.assets import ASSETS, TEXTS
+from game.bot import Bot
+from game.consts import WINDOW_HEIGHT, WINDOW_WIDTH
+from game.events import BUS
+from game.level.campaign import Campaign
+from game.main import FPS, Game, State
+from game.perf import FrameStats
+from game.replay import InputRecording
+from game.rng import RNG
+from game.startup import STARTUP
+from game.timers import TIMERS
+from game.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+
+class HeadlessEngine:
+    """
+    Fixed timestep game loop without a window.
+
+    Every tick advances the simulated clock by one frame, delivers the
+    scripted key presses, timer events and any events posted in response to
+    them, and updates the game. Rendering to an offscreen surface,
+    collecting `FrameStats` and recording the input are optional.
+    """
+
+    TICK_MILLIS = 1000 / FPS
+
+    def __init__(self, game=None, render=False, stats=None, recording=None):
+        pygame.init()
+
+        self.game = game or Game()
+        self.screen = None
+        if render:
+            self.screen = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
+        self.stats = stats
+        self.recording = recording
+        self.ticks = 0
+        self.presented = 0
+
+        self.game.start()
+
+    def tick(self, keys=(), millis=None):
+        """
+        Run one tick, advancing the clock by `millis` (a frame by default)
+        and pressing `keys`.
+        """
+        if millis is None:
+            millis = self.TICK_MILLIS
+        if self.recording is not None:
+            self.recording.begin_tick(millis)
+            for key in keys:
+                self.recording.key(key)
+
+        with TRACER.span("frame"):
+            self._tick(keys, millis)
+
+        if self.stats is not None:
+            self.stats.end_frame()
+
+    def _tick(self, keys, millis):
+        TIMERS.advance(millis)
+
+        with TRACER.span("events"):
+            for key in keys:
+                self.game.handle_event(pygame.event.Event(pygame.KEYDOWN, key=key))
+
+            # events posted while handling are delivered on the same tick, so
+            # the queue is always empty between ticks
+            while BUS.deliver():
+                pass
+
+        self.game.update()
+
+        if self.screen is not None:
+            with TRACER.span("render"):
+                if self.game.render(self.screen):
+                    self.presented += 1
+
+        self.ticks += 1
+
+    def play(self, bot, max_ticks):
+        while self.ticks < max_ticks and not self.game.finished:
+            key = bot.act()
+            self.tick([key] if key is not None else [])
+
+        return self.game.state
+
+    def replay(self, recording):
+        """Play back `recording` as fast as possible."""
+        for millis, keys in recording.playback():
+            if not self.game.running:
+                break
+            self.tick(keys, millis)
+
+        return self.game.state
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Play a level headless with the built-in bot."
+    )
+    parser.add_argument("--map", default="levels/001.map")
+    parser.add_argument("--enemies", default="levels/001.ene")
+    parser.add_argument("--campaign", metavar="MANIFEST")
+    parser.add_argument("--max-ticks", type=int, default=FPS * 60 * 10)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--render", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--event-stats", action="store_true")
+    parser.add_argument("--trace", metavar="PATH")
+    parser.add_argument("--perf-csv", metavar="PATH")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--record", metavar="PATH")
+    parser.add_argument("--replay", metavar="PATH")
+    args = parser.parse_args()
+
+    replay = InputRecording.load(args.replay) if args.replay else None
+    if replay is not None:
+        args.seed = replay.seed
+        args.map = replay.map_filename
+        args.enemies = replay.enemies_filename
+        args.campaign = replay.campaign
+    RNG.seed(args.seed)
+
+    TRACER.enable(bool(args.trace or args.perf_csv))
+    stats = FrameStats(window=args.max_ticks) if args.perf_csv else None
+
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    pygame.init()
+    with STARTUP.phase("atlas"):
+        ASSETS.build()
+    with STARTUP.phase("level"):
+        campaign = None
+        if args.campaign:
+            campaign = Campaign(args.campaign, streaming=args.stream)
+        game = Game(args.map, args.enemies, streaming=args.stream, campaign=campaign)
+
+    recording = None
+    if args.record:
+        recording = InputRecording(
+            RNG.value, args.map, args.enemies, campaign=args.campaign
+        )
+    engine = HeadlessEngine(
+        game, render=args.render, stats=stats, recording=recording
+    )
+    STARTUP.done()
+
+    start = time.perf_counter()
+    if replay is not None:
+        state = engine.replay(replay)
+    else:
+        state = engine.play(Bot(engine.game), args.max_ticks)
+    elapsed = time.perf_counter() - start
+
+    print(STARTUP.report())
+    print(f"Seed: {RNG.value}")
+    print(f"Outcome: {state.name}")
+    print(f"Ticks: {engine.ticks} ({engine.ticks / FPS:.1f} s of game time)")
+    print(f"Wall time: {elapsed:.3f} s")
+    print(f"Throughput: {engine.ticks / elapsed:.0f} ticks/s")
+    if campaign is not None:
+        stalls = ", ".join(f"{stall * 1000:.1f}" for stall in campaign.stalls)
+        print(f"Levels: {len(campaign.stalls)} of {len(campaign)}")
+        print(f"Level load stalls: {stalls} ms")
+        campaign.close()
+    if args.event_stats:
+        print(BUS.report())
+    if args.render:
+        print(f"Frames presented: {engine.presented}")
+        print(f"Text cache: {TEXTS.hits} hits, {TEXTS.misses} misses")
+    if stats is not None:
+        p50, p95, p99 = stats.percentiles()
+        print(f"Tick time: p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms")
+        stats.write_csv(args.perf_csv)
+    if args.trace:
+        print(f"Trace: {TRACER.dump(args.trace)} spans written to {args.trace}")
+
+    if recording is not None:
+        recording.outcome = state.name
+        recording.save(args.record)
+        print(f"Recorded {recording.ticks} ticks to {args.record}")
+
+    pygame.quit()
+
+    if replay is not None:
+        # a recording of a game that was quit ends in whatever state it had
+        if replay.outcome != State.STOPPED.name and state.name != replay.outcome:
+            print(f"Replay diverged: recorded outcome was {replay.outcome}")
+            raise SystemExit(1)
+    elif state != State.LEVEL_CLEARED:
+        raise SystemExit(1)
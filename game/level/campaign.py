@@ -0,0 +1,118 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import time
+
+from game.level import compiled
+from game.level.level import Level
+from game.level.streaming import StreamingLevel
+
+logger = logging.getLogger(__name__)
+
+
+def open_level(filename, enemies_filename=None, streaming=False):
+    """Build the right kind of `Level` for the given files."""
+    if filename.endswith(compiled.SUFFIX):
+        return compiled.CompiledLevel(filename)
+    if streaming:
+        return StreamingLevel(filename, enemies_filename)
+    return Level(filename, enemies_filename)
+
+
+def read_manifest(filename):
+    """
+    Read a campaign manifest into (map, enemies) filename pairs. Every line
+    names the `.map` and `.ene` file of a level, or a compiled level file,
+    relative to the manifest. Empty lines and lines starting with # are
+    skipped.
+    """
+    directory = os.path.dirname(filename)
+    levels = []
+    with open(filename) as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            files = [os.path.join(directory, name) for name in line.split()]
+            if len(files) == 1 and files[0].endswith(compiled.SUFFIX):
+                levels.append((files[0], None))
+            elif len(files) == 2:
+                levels.append((files[0], files[1]))
+            else:
+                raise ValueError(f"{filename}: bad level line {line!r}")
+
+    if not levels:
+        raise ValueError(f"{filename} has no levels")
+    return levels
+
+
+class Campaign:
+    """
+    Levels of a manifest, played in order.
+
+    While a level is played, the next `LOOKAHEAD` levels are parsed and
+    built on a worker thread. At most `MAX_READY` built levels are kept
+    waiting, so moving on to the next level normally only takes a lookup.
+    Levels give their entities randomness and texts of their own, so what
+    they get doesn't depend on when the worker thread builds them.
+    `stalls` records how long every `next` call had to wait for a level.
+    """
+
+    LOOKAHEAD = 1
+    MAX_READY = 2
+
+    def __init__(self, manifest, streaming=False):
+        self.manifest = manifest
+        self.levels = read_manifest(manifest)
+        self.streaming = streaming
+        self.current = -1
+        self.ready = collections.OrderedDict()
+        self.stalls = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="level-loader"
+        )
+
+    def __len__(self):
+        return len(self.levels)
+
+    @property
+    def has_next(self):
+        return self.current + 1 < len(self.levels)
+
+    def next(self):
+        """Return the next level, waiting for it if it isn't built yet."""
+        self.current += 1
+        future = self._prefetch(self.current)
+
+        start = time.perf_counter()
+        level = future.result()
+        self.stalls.append(time.perf_counter() - start)
+        del self.ready[self.current]
+
+        for index in range(self.current + 1, self.current + 1 + self.LOOKAHEAD):
+            if index < len(self.levels):
+                self._prefetch(index)
+
+        logger.debug(
+            "Level %d ready after %.1f ms", self.current, self.stalls[-1] * 1000
+        )
+        return level
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch(self, index):
+        if index in self.ready:
+            return self.ready[index]
+
+        filename, enemies_filename = self.levels[index]
+        future = self.executor.submit(
+            open_level, filename, enemies_filename, self.streaming
+        )
+        self.ready[index] = future
+        while len(self.ready) > self.MAX_READY:
+            _, evicted = self.ready.popitem(last=False)
+            evicted.cancel()
+        return future
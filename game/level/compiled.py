@@ -0,0 +1,179 @@
+"""
+Compiled binary level format.
+
+A compiled level is a single little-endian file:
+
+- header: magic, format version, map height and width, number of entities
+  and a CRC32 checksum of everything after the header
+- tile grid: one uint8 `TileType` value per cell, row by row
+- walkability: one bit per cell, rows packed with `numpy.packbits`
+- entity table: position, type and, for enemies, the difficulty, health
+  and minigame code of every entity, the player first and the rest row by
+  row
+
+Compile a level with
+
+    $ python3 compile_level.py levels/001.map levels/001.ene
+"""
+
+import argparse
+import logging
+import mmap
+import struct
+import zlib
+
+import numpy
+
+from game.level.entity import Player
+from game.level.level import Level, read_codes, read_enemy_props
+from game.level.tile import TileMap
+from game.level.types import EntityType, TileType
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DGNL"
+VERSION = 1
+SUFFIX = ".lvl"
+
+HEADER = struct.Struct("<4sHHIIII")
+ENTITY = numpy.dtype(
+    [
+        ("row", "<u4"),
+        ("col", "<u4"),
+        ("type", "u1"),
+        ("difficulty", "u1"),
+        ("health", "u1"),
+        ("minigame", "S1"),
+    ]
+)
+
+
+def compile_level(filename, enemies_filename):
+    """Return the compiled form of a `.map` and `.ene` file pair."""
+    codes = read_codes(filename)
+    enemies = read_enemy_props(enemies_filename)
+
+    # uint8 scalars keep numpy from going through a wider temporary
+    types = numpy.where(
+        codes == TileType.WALL.value,
+        numpy.uint8(TileType.WALL.value),
+        numpy.uint8(TileType.GROUND.value),
+    )
+    walkable = numpy.packbits(codes != TileType.WALL.value, axis=1)
+
+    positions = numpy.argwhere(codes >= Level.FIRST_ENTITY_CODE)
+    entity_types = codes[positions[:, 0], positions[:, 1]]
+
+    players = positions[entity_types == EntityType.PLAYER.value]
+    if len(players) != 1:
+        raise ValueError(f"{filename} must have exactly one player")
+
+    is_enemy = entity_types == EntityType.ENEMY.value
+    if is_enemy.sum() != len(enemies):
+        raise ValueError(
+            f"{filename} has {is_enemy.sum()} enemies, "
+            f"{enemies_filename} describes {len(enemies)}"
+        )
+    for line, (difficulty, health, minigame) in enumerate(enemies, start=1):
+        # the entity table only has a byte for each of them
+        for name, value in (("difficulty", difficulty), ("health", health)):
+            if not 0 <= value <= numpy.iinfo(ENTITY[name]).max:
+                raise ValueError(
+                    f"{enemies_filename}:{line}: {name} {value} is out of range"
+                )
+        if minigame not in Level.MINIGAMES:
+            raise ValueError(
+                f"{enemies_filename}:{line}: unknown minigame {minigame!r}"
+            )
+
+    table = numpy.zeros(len(positions), dtype=ENTITY)
+    table["row"] = positions[:, 0]
+    table["col"] = positions[:, 1]
+    table["type"] = entity_types
+    if enemies:
+        difficulty, health, minigame = zip(*enemies)
+        table["difficulty"][is_enemy] = difficulty
+        table["health"][is_enemy] = health
+        table["minigame"][is_enemy] = [code.encode() for code in minigame]
+
+    # the player goes first so the loader can find it without a search
+    order = numpy.argsort(entity_types != EntityType.PLAYER.value, kind="stable")
+    body = types.tobytes() + walkable.tobytes() + table[order].tobytes()
+
+    header = HEADER.pack(MAGIC, VERSION, 0, *types.shape, len(table), zlib.crc32(body))
+    return header + body
+
+
+class CompiledLevel(Level):
+    """Level loaded from a memory-mapped compiled level file."""
+
+    def __init__(self, filename, verify=True):
+        self.verify = verify
+        super().__init__(filename, None)
+
+    def _load_map(self, filename):
+        self.enemy_count = 0
+
+        with open(filename, "rb") as level_file:
+            mapped = mmap.mmap(level_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, height, width, count, checksum = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a compiled level")
+        if version != VERSION:
+            raise ValueError(f"{filename} has unsupported version {version}")
+        if self.verify and zlib.crc32(memoryview(mapped)[HEADER.size :]) != checksum:
+            raise ValueError(f"{filename} is corrupted")
+
+        # the tile grid is only there for tools, walkability is all the
+        # game needs
+        offset = HEADER.size + height * width
+
+        packed_width = (width + 7) // 8
+        walkable = numpy.frombuffer(
+            mapped, dtype=numpy.uint8, count=height * packed_width, offset=offset
+        ).reshape(height, packed_width)
+        offset += walkable.nbytes
+
+        table = numpy.frombuffer(mapped, dtype=ENTITY, count=count, offset=offset)
+
+        self.tiles = TileMap(walkable, width)
+
+        for row, col, code, difficulty, health, minigame in table.tolist():
+            entity_type = EntityType(code)
+            if entity_type == EntityType.PLAYER:
+                self.player = Player(self, row, col, entity_type)
+                continue
+
+            entity = self.ENTITY_CLASSES[entity_type](self, row, col, entity_type)
+            if entity_type == EntityType.ENEMY:
+                entity.set_properties(
+                    difficulty, health, self.MINIGAMES[minigame.decode()]
+                )
+                self.enemy_count += 1
+                self.max_enemies += 1
+
+            self.entities[(row, col)] = entity
+
+    def _load_enemy_props(self, filename):
+        # enemy properties are part of the entity table
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile a .map and .ene file pair into a binary level."
+    )
+    parser.add_argument("map")
+    parser.add_argument("enemies")
+    parser.add_argument(
+        "-o", "--output", help="defaults to the map file with a .lvl suffix"
+    )
+    args = parser.parse_args()
+
+    output = args.output or args.map.rsplit(".", 1)[0] + SUFFIX
+    compiled = compile_level(args.map, args.enemies)
+    with open(output, "wb") as output_file:
+        output_file.write(compiled)
+
+    print(f"Wrote {output} ({len(compiled)} bytes)")
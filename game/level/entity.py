@@ -1,34 +1,47 @@
 import logging
-import random
-
-import pygame
 
 from game.assets import ASSETS, TEXTS
 from game.consts import ENTITY_SIZE_PIXELS, TILE_SIZE_PIXELS
 from game.events import CustomEvent
 from game.level.types import EntityMode, ItemType
+from game.timers import TIMERS
+from game.tracing import TRACER
 from game.utils import post_event
 
 
 logger = logging.getLogger(__name__)
 
+# entities are drawn centered on their tile
+OFFSET_PIXELS = (TILE_SIZE_PIXELS - ENTITY_SIZE_PIXELS) // 2
+
 
 class Entity:
+    """
+    Thing standing on a tile of the level.
+
+    Levels can hold hundreds of thousands of entities, so they are slotted
+    records: the sprite is shared with every other entity of the type,
+    flags that only depend on the type are class attributes, and anything
+    expensive, like an enemy's minigame, is only built when it is needed.
+    """
+
+    __slots__ = ("level", "row", "col", "type", "asset", "mode", "text", "color")
+
+    can_bob = False
+
     def __init__(self, level, row, col, type_):
         self.level = level
         self.row = row
         self.col = col
         self.type = type_
 
-        self.asset = ASSETS.load("entities", self.type)
+        self.asset = ASSETS.load("entities", self.type, self.pos)
 
         self.mode = EntityMode.IDLE
 
         self.text = None
         self.color = None
 
-        self.can_bob = False
-
         logger.debug("Spawned %s at %d %d", self.type, row, col)
 
     def __str__(self):
@@ -39,21 +52,24 @@ class Entity:
         return (self.row, self.col)
 
     def render(self, screen, top_left, bob=False):
-        left = (self.col - top_left[1]) * TILE_SIZE_PIXELS + (
-            TILE_SIZE_PIXELS - ENTITY_SIZE_PIXELS
-        ) // 2
-        top = (self.row - top_left[0]) * TILE_SIZE_PIXELS + (
-            TILE_SIZE_PIXELS - ENTITY_SIZE_PIXELS
-        ) // 2
+        screen.blit(*self.placement(top_left, bob))
+        TRACER.count("blits")
+
+    def placement(self, top_left, bob=False):
+        """The sprite and where to draw it, as a `Surface.blits` item."""
+        left = (self.col - top_left[1]) * TILE_SIZE_PIXELS + OFFSET_PIXELS
+        top = (self.row - top_left[0]) * TILE_SIZE_PIXELS + OFFSET_PIXELS
         if self.can_bob and bob:
             top -= 5
-        screen.blit(self.asset, (left, top))
+        return (self.asset, (left, top))
 
     def interact(self):
         logger.debug("Interacting with %s at %d %d", self.type, self.row, self.col)
 
 
 class Player(Entity):
+    __slots__ = ("inventory", "health", "invulnerable")
+
     MAX_HEALTH = 3
 
     def __init__(self, *args, **kwargs):
@@ -75,41 +91,60 @@ class Player(Entity):
             return
 
         self.invulnerable = True
-        pygame.time.set_timer(pygame.event.Event(CustomEvent.IFRAMES_DONE.value), 500)
+        TIMERS.once(CustomEvent.IFRAMES_DONE, 500)
 
     def replenish_health(self):
         self.health = self.MAX_HEALTH
 
 
 class Sign(Entity):
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.text = TEXTS.get_text("signs")
+        self.text = self.level.texts.get_text("signs")
 
     def interact(self):
         post_event(CustomEvent.SHOW_TEXT, text=self.text)
 
 
 class Enemy(Entity):
+    __slots__ = ("difficulty", "health", "minigame_class", "_minigame")
+
+    can_bob = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.text = TEXTS.get_text("enemies")
-        self.color = random.choice(["magenta", "green", "cyan", "violet"])
-        self.minigame = None
+        self.text = self.level.texts.get_text("enemies")
+        self.color = self.level.rng.choice(["magenta", "green", "cyan", "violet"])
         self.difficulty = None
-        self.can_bob = True
+        self.health = None
+        self.minigame_class = None
+        self._minigame = None
 
     @property
     def boss(self):
         return self.difficulty >= 9
 
+    @property
+    def minigame(self):
+        """The minigame to fight this enemy in, built on first use."""
+        if self._minigame is None and self.minigame_class is not None:
+            self._minigame = self.minigame_class(self)
+        return self._minigame
+
     def set_properties(self, difficulty, health, minigame):
         self.difficulty = difficulty
-        self.minigame = minigame(self)
+        self.minigame_class = minigame
         self.health = health
 
+    def reset(self):
+        """Go back to idle, with a fresh minigame for the next fight."""
+        self.mode = EntityMode.IDLE
+        self._minigame = None
+
     def interact(self):
         if self.mode == EntityMode.IDLE:
             self.mode = EntityMode.FIGHT
@@ -135,7 +170,7 @@ class Enemy(Entity):
         self.minigame.reset()
 
     def player_hit(self):
-        if self.minigame is not None:
+        if self._minigame is not None:
             self.minigame.jitters = 3
             self.minigame.set_blurb(
                 TEXTS.get_text("player_hit", exhaust=False), good=False
@@ -144,37 +179,39 @@ class Enemy(Entity):
 
 
 class Key(Entity):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.can_bob = True
+    __slots__ = ()
+
+    can_bob = True
 
     def interact(self):
         post_event(CustomEvent.KEY_PICKED_UP, entity=self)
 
 
 class Door(Entity):
+    __slots__ = ()
+
     def interact(self):
         if ItemType.KEY in self.level.player.inventory:
             post_event(CustomEvent.DOOR_OPENED, entity=self)
 
 
 class Tree(Entity):
-    pass
+    __slots__ = ()
 
 
 class Win(Entity):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.can_bob = True
+    __slots__ = ()
+
+    can_bob = True
 
     def interact(self):
         post_event(CustomEvent.LEVEL_CLEARED, text=TEXTS.get_text("level_cleared"))
 
 
 class Coffee(Entity):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.can_bob = True
+    __slots__ = ()
+
+    can_bob = True
 
     def interact(self):
         post_event(CustomEvent.COFFEE_PICKED_UP, entity=self)
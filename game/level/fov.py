@@ -0,0 +1,174 @@
+import collections
+
+import numpy
+
+from game.consts import TILE_ROWS
+from game.level.types import EntityType, TileType
+
+
+class FieldOfView:
+    """
+    Tiles the player can see, by recursive shadowcasting. Walls and closed
+    doors block sight.
+
+    The result for a position is a square window of `2 * RADIUS + 1` tiles
+    centered on it. Windows are cached per player position and the cache is
+    only dropped when a door is opened, which is the only way the level's
+    walls change. Every tile ever seen is marked in `explored`, a bitmask
+    packed eight columns to a byte, most significant bit first.
+    """
+
+    # the torchlight fades to black within this many tiles
+    RADIUS = TILE_ROWS // 2 + 1
+    BLOCKING_ENTITIES = (EntityType.DOOR,)
+    MAX_CACHED = 256
+
+    # multipliers that map the first octant onto each of the eight
+    OCTANTS = (
+        (1, 0, 0, 1),
+        (0, 1, 1, 0),
+        (0, -1, 1, 0),
+        (-1, 0, 0, 1),
+        (-1, 0, 0, -1),
+        (0, -1, -1, 0),
+        (0, 1, -1, 0),
+        (1, 0, 0, -1),
+    )
+
+    def __init__(self, level):
+        self.level = level
+        self.cache = collections.OrderedDict()
+        self.explored = numpy.zeros(
+            (level.height, (level.width + 7) // 8), dtype=numpy.uint8
+        )
+        self.computed = 0
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def window(self, row, col):
+        """Visibility around (`row`, `col`), indexed relative to `RADIUS`."""
+        key = (row, col)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        window = self._compute(row, col)
+        self.cache[key] = window
+        if len(self.cache) > self.MAX_CACHED:
+            self.cache.popitem(last=False)
+        self._explore(row, col, window)
+        return window
+
+    def visible(self, row, col):
+        """Whether the player can see the tile at (`row`, `col`)."""
+        player = self.level.player
+        d_row = row - player.row + self.RADIUS
+        d_col = col - player.col + self.RADIUS
+        size = 2 * self.RADIUS + 1
+        if not (0 <= d_row < size and 0 <= d_col < size):
+            return False
+        return bool(self.window(player.row, player.col)[d_row, d_col])
+
+    def is_explored(self, row, col):
+        if not (0 <= row < self.level.height and 0 <= col < self.level.width):
+            return False
+        return bool(self.explored[row, col >> 3] & (0x80 >> (col & 7)))
+
+    def mask(self, top, left, rows, cols):
+        """Visibility of the `rows` x `cols` tiles from (`top`, `left`)."""
+        player = self.level.player
+        window = self.window(player.row, player.col)
+
+        mask = numpy.zeros((rows, cols), dtype=bool)
+        window_top = player.row - self.RADIUS
+        window_left = player.col - self.RADIUS
+        size = 2 * self.RADIUS + 1
+
+        # overlap of the window and the requested area, in level coordinates
+        first_row = max(top, window_top)
+        last_row = min(top + rows, window_top + size)
+        first_col = max(left, window_left)
+        last_col = min(left + cols, window_left + size)
+        if first_row < last_row and first_col < last_col:
+            mask[
+                first_row - top : last_row - top, first_col - left : last_col - left
+            ] = window[
+                first_row - window_top : last_row - window_top,
+                first_col - window_left : last_col - window_left,
+            ]
+        return mask
+
+    def _blocks(self, row, col):
+        if self.level.tile(row, col) == TileType.WALL:
+            return True
+        entity = self.level.entities.get((row, col))
+        return entity is not None and entity.type in self.BLOCKING_ENTITIES
+
+    def _compute(self, row, col):
+        self.computed += 1
+        window = numpy.zeros((2 * self.RADIUS + 1,) * 2, dtype=bool)
+        window[self.RADIUS, self.RADIUS] = True
+        for octant in self.OCTANTS:
+            self._cast(row, col, 1, 1.0, 0.0, octant, window)
+        return window
+
+    def _cast(self, row, col, distance, start, end, octant, window):
+        """
+        Scan the rows of one octant from `distance` outwards, between the
+        slopes `start` and `end`, recursing past every wall that splits it.
+        """
+        if start < end:
+            return
+
+        xx, xy, yx, yy = octant
+        radius_squared = self.RADIUS * self.RADIUS
+        new_start = start
+
+        for j in range(distance, self.RADIUS + 1):
+            blocked = False
+            dy = -j
+            for dx in range(-j, 1):
+                left_slope = (dx - 0.5) / (dy + 0.5)
+                right_slope = (dx + 0.5) / (dy - 0.5)
+                if start < right_slope:
+                    continue
+                if end > left_slope:
+                    break
+
+                d_col = dx * xx + dy * xy
+                d_row = dx * yx + dy * yy
+                if dx * dx + dy * dy <= radius_squared:
+                    window[self.RADIUS + d_row, self.RADIUS + d_col] = True
+
+                blocks = self._blocks(row + d_row, col + d_col)
+                if blocked:
+                    if blocks:
+                        new_start = right_slope
+                        continue
+                    blocked = False
+                    start = new_start
+                elif blocks and j < self.RADIUS:
+                    blocked = True
+                    self._cast(row, col, j + 1, start, left_slope, octant, window)
+                    new_start = right_slope
+
+            if blocked:
+                break
+
+    def _explore(self, row, col, window):
+        rows, cols = numpy.nonzero(window)
+        rows += row - self.RADIUS
+        cols += col - self.RADIUS
+        inside = (
+            (rows >= 0)
+            & (rows < self.level.height)
+            & (cols >= 0)
+            & (cols < self.level.width)
+        )
+        rows, cols = rows[inside], cols[inside]
+        numpy.bitwise_or.at(
+            self.explored,
+            (rows, cols >> 3),
+            (0x80 >> (cols & 7)).astype(numpy.uint8),
+        )
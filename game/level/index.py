@@ -0,0 +1,59 @@
+class EntityIndex:
+    """
+    Entities bucketed by square chunks of the grid.
+
+    Area queries only look at the buckets overlapping the area, so their
+    cost depends on the size of the area and not on the number of entities
+    in the level.
+    """
+
+    CHUNK_SIZE = 8
+
+    def __init__(self, entities=()):
+        self.buckets = {}
+        for entity in entities:
+            self.add(entity)
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def add(self, entity):
+        self._bucket(entity.row, entity.col, create=True)[entity.pos] = entity
+
+    def remove(self, entity, pos=None):
+        row, col = pos or entity.pos
+        bucket = self._bucket(row, col)
+        if bucket is None or bucket.pop((row, col), None) is None:
+            return
+
+        if not bucket:
+            del self.buckets[(row // self.CHUNK_SIZE, col // self.CHUNK_SIZE)]
+
+    def move(self, entity, old_pos):
+        """Update the index after `entity` moved away from `old_pos`."""
+        self.remove(entity, old_pos)
+        self.add(entity)
+
+    def query(self, top, left, bottom, right):
+        """Entities with top <= row <= bottom and left <= col <= right."""
+        for chunk_row in range(top // self.CHUNK_SIZE, bottom // self.CHUNK_SIZE + 1):
+            for chunk_col in range(
+                left // self.CHUNK_SIZE, right // self.CHUNK_SIZE + 1
+            ):
+                bucket = self.buckets.get((chunk_row, chunk_col))
+                if bucket is None:
+                    continue
+
+                for (row, col), entity in bucket.items():
+                    if top <= row <= bottom and left <= col <= right:
+                        yield entity
+
+    def near(self, row, col, radius):
+        """Entities at most `radius` tiles away (Chebyshev distance)."""
+        return self.query(row - radius, col - radius, row + radius, col + radius)
+
+    def _bucket(self, row, col, create=False):
+        key = (row // self.CHUNK_SIZE, col // self.CHUNK_SIZE)
+        if create:
+            return self.buckets.setdefault(key, {})
+        return self.buckets.get(key)
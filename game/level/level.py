@@ -1,18 +1,75 @@
 import logging
+import random
 
+import numpy
+
+from game.assets import TEXTS
 from game.consts import TILE_COLS, TILE_ROWS
 from game.controls import Direction
 from game.level.entity import Coffee, Door, Enemy, Player, Tree, Key, Sign, Win
-from game.level.tile import Tile
-from game.level.types import EntityType, ItemType, TileType
+from game.level.fov import FieldOfView
+from game.level.index import EntityIndex
+from game.level.tile import TileLayer, TileMap
+from game.level.types import EntityType, ItemType
 from game.minigame import ColorMinigame, FlashMinigame, PrecisionMinigame
+from game.rng import RNG
+from game.tracing import TRACER
 
 logger = logging.getLogger(__name__)
 
 
+def read_codes(filename):
+    """Read a `.map` file into a (rows, cols) array of its digits."""
+    with open(filename, "rb") as map_file:
+        lines = map_file.read().split()
+
+    for row, line in enumerate(lines):
+        if len(line) != len(lines[0]):
+            raise ValueError(
+                f"{filename}: row {row} has {len(line)} tiles, "
+                f"expected {len(lines[0])} like row 0"
+            )
+
+    return numpy.stack(
+        [numpy.frombuffer(line, dtype=numpy.uint8) for line in lines]
+    ) - ord("0")
+
+
+def read_enemy_props(filename):
+    """Read a `.ene` file into (difficulty, health, minigame code) tuples."""
+    enemies = []
+    with open(filename) as enemies_file:
+        for line in enemies_file:
+            difficulty, health, minigame = line.strip().split()
+            enemies.append((int(difficulty), int(health), minigame))
+    return enemies
+
+
 class Level:
+    ENTITY_CLASSES = {
+        EntityType.PLAYER: Player,
+        EntityType.ENEMY: Enemy,
+        EntityType.SIGN: Sign,
+        EntityType.KEY: Key,
+        EntityType.TREE: Tree,
+        EntityType.DOOR: Door,
+        EntityType.WIN: Win,
+        EntityType.COFFEE: Coffee,
+    }
+    MINIGAMES = {
+        "p": PrecisionMinigame,
+        "f": FlashMinigame,
+        "c": ColorMinigame,
+    }
+    # map codes from this value upwards are entities standing on ground
+    FIRST_ENTITY_CODE = min(entity_type.value for entity_type in EntityType)
+
     def __init__(self, filename, enemies_filename):
-        self.map = []
+        # entities draw from the level's own random stream and texts, so a
+        # level built on a worker thread doesn't touch the shared ones
+        self.rng = random.Random(RNG.derive(f"level:{filename}"))
+        self.texts = TEXTS.pool(self.rng)
+        self.tiles = None
         self.entities = {}
         self.player = None
         self.enemy_count = 0
@@ -21,43 +78,67 @@ class Level:
         self._load_map(filename)
         self._load_enemy_props(enemies_filename)
 
+        self.tile_layer = TileLayer(self)
+        self.index = EntityIndex(self.entities.values())
+        self.fov = FieldOfView(self)
+
     @property
     def width(self):
-        return len(self.map[0])
+        return self.tiles.width
 
     @property
     def height(self):
-        return len(self.map)
+        return self.tiles.height
 
     @property
     def top_left(self):
         return (self.player.row - TILE_ROWS // 2, self.player.col - TILE_COLS // 2)
 
-    def tile(self, row, col):
-        if self._tile_exists(row, col):
-            return self.map[row][col]
-        return Tile(row, col, TileType.WALL)
+    @property
+    def signature(self):
+        """Changes whenever the visible part of the level might have."""
+        return (self.top_left, len(self.entities))
 
-    def render(self, screen, bob):
-        for row in range(self.top_left[0], self.top_left[0] + TILE_ROWS):
-            for col in range(self.top_left[1], self.top_left[1] + TILE_COLS):
-                self.tile(row, col).render(screen, self.top_left)
+    def tile(self, row, col):
+        return self.tiles.type(row, col)
 
-        for (row, col), entity in self.entities.items():
-            if self._tile_visible(row, col):
-                entity.render(screen, self.top_left, bob)
+    def walkable(self, row, col):
+        return self.tiles.walkable(row, col)
 
-        self.player.render(screen, self.top_left)
+    def render(self, screen, bob):
+        """Draw the tiles and entities in the player's field of view."""
+        top_left = self.top_left
+        visible = self.fov.mask(*top_left, TILE_ROWS, TILE_COLS)
+        self.tile_layer.render(screen, top_left, visible)
+
+        # every sprite on screen goes out in a single blits call
+        placements = [
+            entity.placement(top_left, bob)
+            for entity in self.visible_entities()
+            if self.fov.visible(entity.row, entity.col)
+        ]
+        placements.append(self.player.placement(top_left))
+        screen.blits(placements, doreturn=False)
+        TRACER.count("blits", len(placements))
+
+    def visible_entities(self, margin=0):
+        """Entities on screen, or at most `margin` tiles away from it."""
+        top, left = self.top_left
+        return self.index.query(
+            top - margin,
+            left - margin,
+            top + TILE_ROWS + margin,
+            left + TILE_COLS + margin,
+        )
 
     def handle_movement(self, movement):
-        target = self._target_tile(self.player, movement)
-        target_entity = self.entities.get((target.row, target.col))
+        target = self._target(self.player, movement)
+        target_entity = self.entities.get(target)
         if target_entity:
             target_entity.interact()
 
-        elif self._can_move_to(target):
-            self.player.row = target.row
-            self.player.col = target.col
+        elif self.walkable(*target):
+            self.player.row, self.player.col = target
 
     def remove_entity(self, entity):
         row = entity.row
@@ -66,18 +147,30 @@ class Level:
             self.enemy_count -= 1
         elif self.entities[(row, col)].type == EntityType.KEY:
             self.player.inventory.append(ItemType.KEY)
+        elif self.entities[(row, col)].type in self.fov.BLOCKING_ENTITIES:
+            self.fov.invalidate()
 
         del self.entities[(row, col)]
+        self.index.remove(entity)
 
         logger.debug("Entity at %d %d deleted", row, col)
 
+    def move_entity(self, entity, row, col):
+        old_pos = entity.pos
+        del self.entities[old_pos]
+
+        entity.row = row
+        entity.col = col
+        self.entities[entity.pos] = entity
+        self.index.move(entity, old_pos)
+
     def damage_received(self):
         self.player.hit()
 
     def dist_to_player(self, tile):
         return max(abs(tile.row - self.player.row), abs(tile.col - self.player.col))
 
-    def _target_tile(self, origin, movement):
+    def _target(self, origin, movement):
         if movement == Direction.UP:
             vec = (-1, 0)
         elif movement == Direction.RIGHT:
@@ -87,80 +180,40 @@ class Level:
         elif movement == Direction.LEFT:
             vec = (0, -1)
 
-        new_row = origin.row + vec[0]
-        new_col = origin.col + vec[1]
+        return (origin.row + vec[0], origin.col + vec[1])
 
-        return self.tile(new_row, new_col)
+    def _load_map(self, filename):
+        self.enemy_count = 0
 
-    def _can_move_to(self, target):
-        return target and target.walkable
+        codes = read_codes(filename)
+        self.tiles = TileMap.from_codes(codes)
 
-    def _tile_exists(self, row, col):
-        return 0 <= row <= self.height - 1 and 0 <= col <= self.width - 1
+        for row, col in numpy.argwhere(codes >= self.FIRST_ENTITY_CODE).tolist():
+            entity_type = EntityType(int(codes[row, col]))
 
-    def _tile_visible(self, row, col):
-        return (
-            self.top_left[0] <= row <= self.top_left[0] + TILE_ROWS
-            and self.top_left[1] <= col <= self.top_left[1] + TILE_COLS
-        )
+            if entity_type == EntityType.PLAYER:
+                self.player = Player(self, row, col, entity_type)
+                continue
 
-    def _load_map(self, filename):
-        self.enemy_count = 0
+            elif entity_type == EntityType.ENEMY:
+                self.enemy_count += 1
+                self.max_enemies += 1
 
-        cls = {
-            EntityType.PLAYER: Player,
-            EntityType.ENEMY: Enemy,
-            EntityType.SIGN: Sign,
-            EntityType.KEY: Key,
-            EntityType.TREE: Tree,
-            EntityType.DOOR: Door,
-            EntityType.WIN: Win,
-            EntityType.COFFEE: Coffee,
-        }
-
-        with open(filename) as map_file:
-            for row, line in enumerate(map_file):
-                self.map.append([])
-                for col, code in enumerate(line.strip()):
-                    code = int(code)
-                    try:
-                        tile_type = TileType(code)
-                    except ValueError:
-                        tile_type = TileType(TileType.GROUND)
-
-                    self.map[-1].append(Tile(row, col, tile_type))
-
-                    try:
-                        entity_type = EntityType(code)
-                    except ValueError:
-                        continue
-
-                    if entity_type == EntityType.PLAYER:
-                        self.player = Player(self, row, col, entity_type)
-                        continue
-
-                    elif entity_type == EntityType.ENEMY:
-                        self.enemy_count += 1
-                        self.max_enemies += 1
-
-                    self.entities[(row, col)] = cls[entity_type](
-                        self, row, col, entity_type
-                    )
+            self.entities[(row, col)] = self.ENTITY_CLASSES[entity_type](
+                self, row, col, entity_type
+            )
 
     def _load_enemy_props(self, filename):
-        enemies = []
-        with open(filename) as enemies_file:
-            for line in enemies_file:
-                difficulty, health, minigame = line.strip().split()
-                minigame = {
-                    "p": PrecisionMinigame,
-                    "f": FlashMinigame,
-                    "c": ColorMinigame,
-                }[minigame]
-                enemies.append((int(difficulty), int(health), minigame))
+        enemies = self._read_enemy_props(filename)
 
         i = 0
         for entity in self.entities.values():
             if entity.type == EntityType.ENEMY:
                 entity.set_properties(*enemies[i])
                 i += 1
+
+    def _read_enemy_props(self, filename):
+        return [
+            (difficulty, health, self.MINIGAMES[minigame])
+            for difficulty, health, minigame in read_enemy_props(filename)
+        ]
@@ -0,0 +1,333 @@
+import collections
+import hashlib
+import logging
+import mmap
+import os
+import struct
+
+import numpy
+
+from game.assets import ASSETS
+from game.level.entity import Player
+from game.level.level import Level
+from game.level.tile import TileMap
+from game.level.types import EntityType, TileType
+
+logger = logging.getLogger(__name__)
+
+# cached scan of a map and its enemies: magic, format version, map height,
+# the player's row and column and the number of enemies, followed by the
+# number of enemies above every row and the offset of every line of the
+# `.ene` file, and its end
+SCAN_MAGIC = b"DGNS"
+SCAN_VERSION = 1
+SCAN_HEADER = struct.Struct("<4sHIIII")
+
+
+def map_codes(filename):
+    """
+    Memory-map a `.map` file and return a (rows, cols) uint8 view of its
+    characters, without the line endings. Nothing is read until used.
+    """
+    with open(filename, "rb") as map_file:
+        mapped = mmap.mmap(map_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    raw = numpy.frombuffer(mapped, dtype=numpy.uint8)
+    newline = mapped.find(b"\n")
+    if newline == -1:
+        return raw.reshape(1, -1)
+
+    stride = newline + 1
+    width = newline - (newline > 0 and raw[newline - 1] == ord("\r"))
+    height = (len(raw) - width) // stride + 1
+    return numpy.lib.stride_tricks.as_strided(
+        raw, shape=(height, width), strides=(stride, 1), writeable=False
+    )
+
+
+def map_bytes(filename):
+    """Memory-map a file as a uint8 array. Nothing is read until used."""
+    with open(filename, "rb") as mapped_file:
+        if os.fstat(mapped_file.fileno()).st_size == 0:
+            return numpy.zeros(0, dtype=numpy.uint8)
+        mapped = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return numpy.frombuffer(mapped, dtype=numpy.uint8)
+
+
+def scan_cache_path(*filenames):
+    """Where the scan of some files is cached, by their paths, sizes and mtimes."""
+    key = ""
+    for filename in filenames:
+        stat = os.stat(filename)
+        key += f"{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}\n"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(ASSETS.CACHE_DIR, f"scan-{digest}.bin")
+
+
+class MappedTileMap(TileMap):
+    """
+    Tile map over a memory-mapped `.map` file.
+
+    Cells are materialized one square chunk at a time when they are first
+    looked at, and the least recently used chunks are dropped again once
+    more than `MAX_CHUNKS` are loaded. Sprite variants are seeded per chunk
+    so a chunk looks the same every time it is loaded.
+    """
+
+    CHUNK_SIZE = 32
+    MAX_CHUNKS = 64
+
+    def __init__(self, chars, on_load=None, on_evict=None):
+        self.chars = chars
+        self.on_load = on_load
+        self.on_evict = on_evict
+        self.chunks = collections.OrderedDict()
+        self.sprites = [ASSETS.variants("tiles", tile_type) for tile_type in TileType]
+
+    @property
+    def height(self):
+        return self.chars.shape[0]
+
+    @property
+    def width(self):
+        return self.chars.shape[1]
+
+    def type(self, row, col):
+        if not self.exists(row, col):
+            return super().type(row, col)
+        chunk, row, col = self._locate(row, col)
+        return chunk.type(row, col)
+
+    def walkable(self, row, col):
+        if not self.exists(row, col):
+            return super().walkable(row, col)
+        chunk, row, col = self._locate(row, col)
+        return chunk.walkable(row, col)
+
+    def sprite(self, row, col):
+        if not self.exists(row, col):
+            return super().sprite(row, col)
+        chunk, row, col = self._locate(row, col)
+        return chunk.sprite(row, col)
+
+    def touch(self, chunk_row, chunk_col):
+        """Load a chunk if needed and mark it as recently used."""
+        key = (chunk_row, chunk_col)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+
+        top = chunk_row * self.CHUNK_SIZE
+        left = chunk_col * self.CHUNK_SIZE
+        codes = self.chars[
+            top : top + self.CHUNK_SIZE, left : left + self.CHUNK_SIZE
+        ] - ord("0")
+        chunk = TileMap.from_codes(
+            codes, seed=(ASSETS.variant_seed, chunk_row, chunk_col)
+        )
+        self.chunks[key] = chunk
+        logger.debug("Loaded chunk %d %d", chunk_row, chunk_col)
+
+        if self.on_load is not None:
+            self.on_load(top, left, codes)
+
+        while len(self.chunks) > self.MAX_CHUNKS:
+            (evicted_row, evicted_col), _ = self.chunks.popitem(last=False)
+            logger.debug("Evicted chunk %d %d", evicted_row, evicted_col)
+            if self.on_evict is not None:
+                self.on_evict(
+                    evicted_row * self.CHUNK_SIZE,
+                    evicted_col * self.CHUNK_SIZE,
+                    self.CHUNK_SIZE,
+                )
+
+        return chunk
+
+    def _locate(self, row, col):
+        chunk = self.touch(row // self.CHUNK_SIZE, col // self.CHUNK_SIZE)
+        return chunk, row % self.CHUNK_SIZE, col % self.CHUNK_SIZE
+
+
+class StreamingLevel(Level):
+    """
+    Level backed by a `MappedTileMap`.
+
+    Only the chunks within `VIEW_DISTANCE` chunks of the player are kept
+    loaded. Entities are spawned when their chunk is loaded and dropped when
+    it is evicted; removed entities are remembered so they stay gone, and
+    entities with a text and colour of their own are kept as they are to be
+    spawned again. Enemies are looked up in the memory-mapped `.ene` file
+    when they spawn. To find the player, to number the enemies and to find
+    their lines, the map and the `.ene` file are scanned once, with numpy,
+    and the result is cached so later startups read neither of them.
+    """
+
+    VIEW_DISTANCE = 1
+    SCAN_ROWS = 1024
+
+    def __init__(self, filename, enemies_filename):
+        self.enemies_filename = enemies_filename
+        super().__init__(filename, enemies_filename)
+        self.stream()
+
+    def handle_movement(self, movement):
+        super().handle_movement(movement)
+        self.stream()
+
+    def remove_entity(self, entity):
+        super().remove_entity(entity)
+        self.removed.add(entity.pos)
+
+    def stream(self):
+        """Make sure the chunks around the player are loaded."""
+        size = self.tiles.CHUNK_SIZE
+        player_chunk = (self.player.row // size, self.player.col // size)
+        max_chunk = ((self.height - 1) // size, (self.width - 1) // size)
+
+        for d_row in range(-self.VIEW_DISTANCE, self.VIEW_DISTANCE + 1):
+            for d_col in range(-self.VIEW_DISTANCE, self.VIEW_DISTANCE + 1):
+                chunk_row = player_chunk[0] + d_row
+                chunk_col = player_chunk[1] + d_col
+                if 0 <= chunk_row <= max_chunk[0] and 0 <= chunk_col <= max_chunk[1]:
+                    self.tiles.touch(chunk_row, chunk_col)
+
+        # the player's chunk is the last one to be evicted
+        self.tiles.touch(*player_chunk)
+
+    def _load_map(self, filename):
+        self.removed = set()
+        # evicted entities that are spawned again as they are
+        self.evicted = {}
+        self.tiles = MappedTileMap(
+            map_codes(filename), on_load=self._spawn, on_evict=self._despawn
+        )
+        self.enemy_lines = map_bytes(self.enemies_filename)
+
+        path = scan_cache_path(filename, self.enemies_filename)
+        try:
+            self._read_scan(path)
+            logger.debug("Read the scan of %s from %s", filename, path)
+        except (OSError, ValueError, struct.error):
+            self._scan()
+            if len(self.enemy_offsets) <= self.enemy_count:
+                raise ValueError(
+                    f"{filename} has {self.enemy_count} enemies, "
+                    f"{self.enemies_filename} describes {len(self.enemy_offsets) - 1}"
+                )
+            self._write_scan(path)
+
+    def _load_enemy_props(self, filename):
+        # enemies are read from the `.ene` file as they spawn
+        pass
+
+    def _scan(self):
+        """
+        Find the player, count the enemies on each row and find the lines of
+        the `.ene` file.
+        """
+        chars = self.tiles.chars
+        player = ord("0") + EntityType.PLAYER.value
+        enemy = ord("0") + EntityType.ENEMY.value
+
+        enemies_per_row = []
+        for top in range(0, self.height, self.SCAN_ROWS):
+            rows = chars[top : top + self.SCAN_ROWS]
+            enemies_per_row.append(numpy.count_nonzero(rows == enemy, axis=1))
+
+            if self.player is None:
+                found = numpy.argwhere(rows == player)
+                if len(found):
+                    row, col = found[0].tolist()
+                    self.player = Player(self, top + row, col, EntityType.PLAYER)
+
+        enemies_per_row = numpy.concatenate(enemies_per_row)
+        self.enemies_before = numpy.cumsum(enemies_per_row) - enemies_per_row
+        self.enemy_count = self.max_enemies = int(enemies_per_row.sum())
+
+        lines = self.enemy_lines
+        offsets = [[0], numpy.flatnonzero(lines == ord("\n")) + 1]
+        if len(lines) and lines[-1] != ord("\n"):
+            offsets.append([len(lines)])
+        self.enemy_offsets = numpy.concatenate(offsets)[: self.enemy_count + 1]
+
+    def _read_scan(self, path):
+        with open(path, "rb") as scan_file:
+            mapped = mmap.mmap(scan_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, height, row, col, count = SCAN_HEADER.unpack_from(mapped)
+        if magic != SCAN_MAGIC or version != SCAN_VERSION or height != self.height:
+            raise ValueError(f"{path} is not a scan of this map")
+
+        self.enemies_before = numpy.frombuffer(
+            mapped, dtype="<u4", count=height, offset=SCAN_HEADER.size
+        )
+        self.enemy_offsets = numpy.frombuffer(
+            mapped,
+            dtype="<u8",
+            count=count + 1,
+            offset=SCAN_HEADER.size + self.enemies_before.nbytes,
+        )
+        self.player = Player(self, row, col, EntityType.PLAYER)
+        self.enemy_count = self.max_enemies = count
+
+    def _write_scan(self, path):
+        header = SCAN_HEADER.pack(
+            SCAN_MAGIC,
+            SCAN_VERSION,
+            self.height,
+            *self.player.pos,
+            self.enemy_count,
+        )
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written aside and moved in place, so readers never see half of it
+            with open(f"{path}.tmp", "wb") as scan_file:
+                scan_file.write(header)
+                scan_file.write(self.enemies_before.astype("<u4").tobytes())
+                scan_file.write(self.enemy_offsets.astype("<u8").tobytes())
+            os.replace(f"{path}.tmp", path)
+            logger.debug("Saved the scan to %s", path)
+        except OSError as e:
+            logger.warning("Could not cache the map scan: %s", e)
+
+    def _enemy_number(self, row, col):
+        enemy = ord("0") + EntityType.ENEMY.value
+        return int(self.enemies_before[row]) + int(
+            numpy.count_nonzero(self.tiles.chars[row, :col] == enemy)
+        )
+
+    def _enemy_props(self, number):
+        """The properties of an enemy, from its line of the `.ene` file."""
+        start, end = self.enemy_offsets[number : number + 2].tolist()
+        difficulty, health, minigame = bytes(self.enemy_lines[start:end]).split()
+        return int(difficulty), int(health), self.MINIGAMES[minigame.decode()]
+
+    def _spawn(self, top, left, codes):
+        for row, col in numpy.argwhere(codes >= self.FIRST_ENTITY_CODE).tolist():
+            pos = (top + row, left + col)
+            entity_type = EntityType(int(codes[row, col]))
+            if entity_type == EntityType.PLAYER or pos in self.removed:
+                continue
+
+            entity = self.evicted.pop(pos, None)
+            if entity is None:
+                entity = self._create(pos, entity_type)
+
+            self.entities[pos] = entity
+            self.index.add(entity)
+
+    def _create(self, pos, entity_type):
+        entity = self.ENTITY_CLASSES[entity_type](self, *pos, entity_type)
+        if entity_type == EntityType.ENEMY:
+            entity.set_properties(*self._enemy_props(self._enemy_number(*pos)))
+        return entity
+
+    def _despawn(self, top, left, size):
+        for entity in list(
+            self.index.query(top, left, top + size - 1, left + size - 1)
+        ):
+            del self.entities[entity.pos]
+            self.index.remove(entity)
+            # a new one would get another text and colour
+            if entity.text is not None:
+                self.evicted[entity.pos] = entity
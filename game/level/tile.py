@@ -1,30 +1,209 @@
+import collections
+
+import numpy
+import pygame
+
 from game.assets import ASSETS
-from game.consts import TILE_SIZE_PIXELS
+from game.consts import (
+    TILE_COLS,
+    TILE_ROWS,
+    TILE_SIZE_PIXELS,
+    WINDOW_HEIGHT,
+    WINDOW_WIDTH,
+)
 from game.level.types import TileType
+from game.tracing import TRACER
 
 
-class Tile:
-    def __init__(self, row, col, type_):
-        self.row = row
-        self.col = col
-        self.type = type_
+class TileMap:
+    """
+    Tile grid stored as one bit per cell, set where the cell is walkable,
+    rows packed eight columns to a byte, most significant bit first. Walls
+    are the only tiles that can't be walked on, so this is also the tile
+    type. Sprite variants aren't stored but derived from the position and
+    `seed`, and sprites are shared between all cells of the same type and
+    variant.
+    """
 
-        self.asset = ASSETS.load("tiles", self.type)
+    def __init__(self, packed_walkable, width, seed=None):
+        self.packed_walkable = packed_walkable
+        self._width = width
+        self.seed = ASSETS.variant_seed if seed is None else seed
+        self.sprites = [ASSETS.variants("tiles", tile_type) for tile_type in TileType]
+
+    @classmethod
+    def from_codes(cls, codes, seed=None):
+        """
+        Build the map from the digit codes of a `.map` file. Sprite variants
+        are picked at random, reproducibly for the same `seed` (the asset
+        manager's seed by default).
+        """
+        return cls(
+            numpy.packbits(codes != TileType.WALL.value, axis=1), codes.shape[1], seed
+        )
 
     @property
-    def pos(self):
-        return (self.row, self.col)
+    def height(self):
+        return self.packed_walkable.shape[0]
 
     @property
-    def walkable(self):
-        return self.type not in {TileType.WALL}
+    def width(self):
+        return self._width
+
+    def exists(self, row, col):
+        return 0 <= row < self.height and 0 <= col < self.width
+
+    def type(self, row, col):
+        if self.walkable(row, col):
+            return TileType.GROUND
+        return TileType.WALL
+
+    def walkable(self, row, col):
+        return self.exists(row, col) and bool(
+            self.packed_walkable[row, col >> 3] & (0x80 >> (col & 7))
+        )
+
+    def sprite(self, row, col):
+        if self.exists(row, col):
+            sprites = self.sprites[self.type(row, col).value]
+            return sprites[hash((self.seed, row, col)) % len(sprites)]
+        return self.sprites[TileType.WALL.value][0]
+
+
+class TileLayer:
+    """
+    Static tile layer baked into fixed-size chunk surfaces.
+
+    Chunks are baked the first time they come into view and kept in a
+    bounded LRU cache, so drawing the viewport costs a handful of blits no
+    matter how large the map is.
+    """
+
+    CHUNK_SIZE = 8
+    MAX_CHUNKS = 36
+
+    def __init__(self, level):
+        self.level = level
+        self.chunks = collections.OrderedDict()
+        self.visible_key = None
+        self.visible_runs = []
 
-    def render(self, screen, top_left):
-        if self.asset is None:
+    def chunk(self, chunk_row, chunk_col):
+        key = (chunk_row, chunk_col)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+
+        surface = self._bake(chunk_row, chunk_col)
+        self.chunks[key] = surface
+        if len(self.chunks) > self.MAX_CHUNKS:
+            self.chunks.popitem(last=False)
+        return surface
+
+    def invalidate(self, row, col):
+        self.chunks.pop((row // self.CHUNK_SIZE, col // self.CHUNK_SIZE), None)
+
+    def render(self, screen, top_left, visible=None):
+        """
+        Draw the viewport with its top left tile at `top_left`. With
+        `visible`, a (TILE_ROWS, TILE_COLS) mask, only the visible tiles are
+        drawn, a horizontal run of them per blit.
+        """
+        if visible is not None:
+            self._render_visible(screen, top_left, visible)
             return
 
-        rect = (
-            (self.col - top_left[1]) * TILE_SIZE_PIXELS,
-            (self.row - top_left[0]) * TILE_SIZE_PIXELS,
+        first_row = top_left[0] // self.CHUNK_SIZE
+        last_row = (top_left[0] + TILE_ROWS - 1) // self.CHUNK_SIZE
+        first_col = top_left[1] // self.CHUNK_SIZE
+        last_col = (top_left[1] + TILE_COLS - 1) // self.CHUNK_SIZE
+
+        chunk_pixels = self.CHUNK_SIZE * TILE_SIZE_PIXELS
+        for chunk_row in range(first_row, last_row + 1):
+            for chunk_col in range(first_col, last_col + 1):
+                left = chunk_col * chunk_pixels - top_left[1] * TILE_SIZE_PIXELS
+                top = chunk_row * chunk_pixels - top_left[0] * TILE_SIZE_PIXELS
+                area = pygame.Rect(-left, -top, WINDOW_WIDTH, WINDOW_HEIGHT)
+                screen.blit(
+                    self.chunk(chunk_row, chunk_col),
+                    (max(left, 0), max(top, 0)),
+                    area.clip(0, 0, chunk_pixels, chunk_pixels),
+                )
+                TRACER.count("blits")
+
+    def _render_visible(self, screen, top_left, visible):
+        # the runs only change when the player moves or a door opens
+        key = (top_left, visible.tobytes())
+        if key != self.visible_key:
+            self.visible_key = key
+            self.visible_runs = self._runs(top_left, visible.tolist())
+
+        screen.blits(
+            [
+                (self.chunk(*chunk), dest, area)
+                for chunk, dest, area in self.visible_runs
+            ],
+            doreturn=False,
         )
-        screen.blit(self.asset, rect)
+        TRACER.count("blits", len(self.visible_runs))
+
+    def _runs(self, top_left, visible):
+        """
+        Chunk, screen position and chunk area of every horizontal run of
+        visible tiles, split where the run crosses into the next chunk.
+        """
+        runs = []
+        for i, row_mask in enumerate(visible):
+            row = top_left[0] + i
+            chunk_row, chunk_top = divmod(row, self.CHUNK_SIZE)
+            col = 0
+            while col < TILE_COLS:
+                if not row_mask[col]:
+                    col += 1
+                    continue
+
+                start = col
+                chunk_col, chunk_left = divmod(top_left[1] + start, self.CHUNK_SIZE)
+                chunk_end = start + self.CHUNK_SIZE - chunk_left
+                while col < min(TILE_COLS, chunk_end) and row_mask[col]:
+                    col += 1
+
+                runs.append(
+                    (
+                        (chunk_row, chunk_col),
+                        (start * TILE_SIZE_PIXELS, i * TILE_SIZE_PIXELS),
+                        pygame.Rect(
+                            chunk_left * TILE_SIZE_PIXELS,
+                            chunk_top * TILE_SIZE_PIXELS,
+                            (col - start) * TILE_SIZE_PIXELS,
+                            TILE_SIZE_PIXELS,
+                        ),
+                    )
+                )
+        return runs
+
+    def _bake(self, chunk_row, chunk_col):
+        size = self.CHUNK_SIZE * TILE_SIZE_PIXELS
+        surface = pygame.Surface((size, size))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        TRACER.count("surfaces")
+        TRACER.count("blits", self.CHUNK_SIZE * self.CHUNK_SIZE)
+
+        origin = (chunk_row * self.CHUNK_SIZE, chunk_col * self.CHUNK_SIZE)
+        surface.blits(
+            [
+                (
+                    self.level.tiles.sprite(row, col),
+                    (
+                        (col - origin[1]) * TILE_SIZE_PIXELS,
+                        (row - origin[0]) * TILE_SIZE_PIXELS,
+                    ),
+                )
+                for row in range(origin[0], origin[0] + self.CHUNK_SIZE)
+                for col in range(origin[1], origin[1] + self.CHUNK_SIZE)
+            ],
+            doreturn=False,
+        )
+
+        return surface
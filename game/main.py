@@ -1,20 +1,37 @@
 import enum
 import logging
+import os
 import sys
 
 import pygame
 
-from game.assets import SOUNDS, TEXTS
+from game.assets import ASSETS, SOUNDS, TEXTS
 from game.consts import GAME_TITLE, WINDOW_HEIGHT, WINDOW_WIDTH
-from game.controls import MOVEMENT_CONTROLS
-from game.events import CustomEvent
-from game.level.level import Level
-from game.overlay import HUDOverlay, TextOverlay, TorchlightOverlay
-
-
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+from game.controls import MOVEMENT_CONTROLS, PERF_KEY, TRACE_KEY
+from game.events import BUS, CustomEvent
+from game.level.campaign import Campaign, open_level
+from game.overlay import (
+    HUDOverlay,
+    PerformanceOverlay,
+    TextOverlay,
+    TorchlightOverlay,
+)
+from game.pacing import FramePacer
+from game.perf import FrameStats
+from game.replay import InputRecording
+from game.rng import RNG
+from game.startup import STARTUP
+from game.timers import TIMERS
+from game.tracing import TRACER
+from game.utils import post_event
+
+
+logging.basicConfig(stream=sys.stdout, level=os.environ.get("GAME_LOG", "INFO"))
 logger = logging.getLogger(__name__)
 
+FPS = 60
+CAMPAIGN = "levels/campaign.txt"
+
 
 class State(enum.Enum):
     RUNNING = 0
@@ -25,133 +42,410 @@ class State(enum.Enum):
     LEVEL_CLEARED = 5
 
 
-def run():
-    pygame.init()
-
-    logger.debug("Setting window size to %d x %d", WINDOW_WIDTH, WINDOW_HEIGHT)
-
-    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-    pygame.display.set_caption(GAME_TITLE)
-    clock = pygame.time.Clock()
-    state = State.RUNNING
-    torchlight_overlay = TorchlightOverlay()
-    text_overlay = TextOverlay()
-    music = SOUNDS.play()
-    minigame = None
-    bob = False
-
-    level = Level("levels/001.map", "levels/001.ene")
-    hud_overlay = HUDOverlay(level)
-
-    pygame.time.set_timer(
-        pygame.event.Event(CustomEvent.REGENERATE_TORCHLIGHT.value), 800
-    )
-    pygame.time.set_timer(pygame.event.Event(CustomEvent.ENTITY_BOB.value), 500)
-    pygame.time.set_timer(
-        pygame.event.Event(CustomEvent.COLOR_MINIGAME_ADD_ITEM.value), 750
-    )
-
-    pygame.event.post(
-        pygame.event.Event(CustomEvent.SHOW_TEXT.value, text=TEXTS.get_text("intro"))
-    )
-
-    while state != State.STOPPED:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                state = state.STOPPED
-
-            elif event.type == CustomEvent.INITIALIZE_MINIGAME.value:
-                minigame = event.minigame
-
-            elif event.type == CustomEvent.ENEMY_HIT.value:
-                event.enemy.damage_received()
-
-            elif event.type == CustomEvent.ENEMY_DEFEATED.value:
-                level.remove_entity(event.enemy)
-                minigame = None
-                state = State.RUNNING
-
-            elif event.type == CustomEvent.DAMAGE_RECEIVED.value:
-                level.damage_received()
-                event.enemy.player_hit()
-
-            elif event.type == CustomEvent.IFRAMES_DONE.value:
-                level.player.invulnerable = False
-                pygame.time.set_timer(
-                    pygame.event.Event(CustomEvent.IFRAMES_DONE.value), 0
+class Game:
+    """
+    Game state machine, decoupled from the window, the clock and the
+    event source so it can be driven both by `run` and by the headless
+    engine. Events are handled through the handlers it registers on `BUS`.
+    """
+
+    # repeating timers and the states they run in, None for all of them
+    TIMERS = {
+        CustomEvent.REGENERATE_TORCHLIGHT: (800, (State.RUNNING,)),
+        CustomEvent.ENTITY_BOB: (500, None),
+    }
+
+    SCREEN_RECT = pygame.Rect(0, 0, WINDOW_WIDTH, WINDOW_HEIGHT)
+
+    def __init__(
+        self,
+        filename="levels/001.map",
+        enemies_filename="levels/001.ene",
+        streaming=False,
+        campaign=None,
+    ):
+        self.filename = filename
+        self.enemies_filename = enemies_filename
+        self.campaign = campaign
+        self.state = State.RUNNING
+        self.text_overlay = TextOverlay()
+        self.minigame = None
+        self.bob = False
+        # the next level is entered once the level cleared text is dismissed
+        self.advance_pending = False
+
+        if campaign is not None:
+            self.level = campaign.next()
+        else:
+            self.level = open_level(filename, enemies_filename, streaming)
+        self.torchlight_overlay = TorchlightOverlay(self.level)
+        self.hud_overlay = HUDOverlay(self.level)
+
+        # signature and rect of every layer as of the last rendered frame
+        self.drawn = {}
+
+        self._subscribe()
+
+    @property
+    def running(self):
+        return self.state != State.STOPPED
+
+    @property
+    def animating(self):
+        """
+        Whether the screen changes from frame to frame by itself. Otherwise
+        it only changes on input and on timers.
+        """
+        return self.state == State.MINIGAME
+
+    @property
+    def finished(self):
+        return self.state in (State.STOPPED, State.GAME_OVER, State.LEVEL_CLEARED)
+
+    def start(self, intro=True):
+        TIMERS.reset(state=lambda: self.state)
+        for custom_event, (millis, states) in self.TIMERS.items():
+            TIMERS.start(custom_event, millis, states=states)
+
+        if intro:
+            post_event(CustomEvent.SHOW_TEXT, text=TEXTS.get_text("intro"))
+
+    def handle_event(self, event):
+        BUS.dispatch(event)
+
+    def _subscribe(self):
+        BUS.reset(state=lambda: self.state)
+
+        handlers = [
+            (pygame.QUIT, self._quit, None),
+            (CustomEvent.INITIALIZE_MINIGAME, self._initialize_minigame, None),
+            (CustomEvent.ENEMY_HIT, self._enemy_hit, None),
+            (CustomEvent.ENEMY_DEFEATED, self._enemy_defeated, None),
+            (CustomEvent.DAMAGE_RECEIVED, self._damage_received, None),
+            (CustomEvent.IFRAMES_DONE, self._iframes_done, None),
+            (CustomEvent.GAME_OVER, self._game_over, None),
+            (CustomEvent.LEVEL_CLEARED, self._level_cleared, None),
+            (CustomEvent.ENTITY_BOB, self._bob, None),
+            (pygame.KEYDOWN, self._move, State.RUNNING),
+            (CustomEvent.REGENERATE_TORCHLIGHT, self._torchlight, State.RUNNING),
+            (CustomEvent.SHOW_TEXT, self._show_text, State.RUNNING),
+            (CustomEvent.KEY_PICKED_UP, self._remove_entity, State.RUNNING),
+            (CustomEvent.COFFEE_PICKED_UP, self._coffee_picked_up, State.RUNNING),
+            (CustomEvent.DOOR_OPENED, self._remove_entity, State.RUNNING),
+            (pygame.KEYDOWN, self._dismiss_text, State.OVERLAY),
+            (pygame.KEYDOWN, self._minigame_input, State.MINIGAME),
+            (CustomEvent.COLOR_MINIGAME_ADD_ITEM, self._add_item, State.MINIGAME),
+        ]
+        for event_type, handler, state in handlers:
+            BUS.subscribe(event_type, handler, state)
+
+    def _quit(self, event):
+        self.state = State.STOPPED
+
+    def _initialize_minigame(self, event):
+        self.minigame = event.minigame
+
+    def _enemy_hit(self, event):
+        event.enemy.damage_received()
+
+    def _enemy_defeated(self, event):
+        TIMERS.cancel(CustomEvent.COLOR_MINIGAME_ADD_ITEM)
+        self.level.remove_entity(event.enemy)
+        self.minigame = None
+        self.state = State.RUNNING
+
+    def _damage_received(self, event):
+        self.level.damage_received()
+        event.enemy.player_hit()
+
+    def _iframes_done(self, event):
+        self.level.player.invulnerable = False
+
+    def _game_over(self, event):
+        self.state = State.GAME_OVER
+        self.text_overlay.set_text("GAME OVER\n\n" + event.text, color="red")
+
+    def _level_cleared(self, event):
+        if self.campaign is not None and self.campaign.has_next:
+            self.state = State.OVERLAY
+            self.advance_pending = True
+        else:
+            self.state = State.LEVEL_CLEARED
+        self.text_overlay.set_text("LEVEL CLEARED!\n\n" + event.text, color="green")
+
+    def _bob(self, event):
+        self.bob = not self.bob
+
+    def _move(self, event):
+        if event.key in MOVEMENT_CONTROLS:
+            self.level.handle_movement(MOVEMENT_CONTROLS[event.key])
+
+    def _torchlight(self, event):
+        self.torchlight_overlay.generate()
+
+    def _show_text(self, event):
+        self.state = State.OVERLAY
+        self.text_overlay.set_text(
+            event.text,
+            color=getattr(event, "color", None),
+        )
+
+    def _remove_entity(self, event):
+        self.level.remove_entity(event.entity)
+
+    def _coffee_picked_up(self, event):
+        self.level.remove_entity(event.entity)
+        self.level.player.replenish_health()
+
+    def _dismiss_text(self, event):
+        self.state = State.RUNNING
+        self.text_overlay.dismiss()
+
+        if self.advance_pending:
+            self._advance()
+        elif self.minigame is not None and not self.minigame.started:
+            self.state = State.MINIGAME
+            self.minigame.start()
+            if self.minigame.ADD_ITEM_MILLIS is not None:
+                TIMERS.start(
+                    CustomEvent.COLOR_MINIGAME_ADD_ITEM,
+                    self.minigame.ADD_ITEM_MILLIS,
+                    states=(State.MINIGAME,),
                 )
 
-            elif event.type == CustomEvent.GAME_OVER.value:
-                state = State.GAME_OVER
-                text_overlay.set_text("GAME OVER\n\n" + event.text, color="red")
+    def _advance(self):
+        """
+        Swap in the campaign's next level. It has normally been built in the
+        background while this one was played, so this takes a single frame.
+        """
+        self.advance_pending = False
+        self.level = self.campaign.next()
+        self.torchlight_overlay.level = self.level
+        self.torchlight_overlay.key = None
+        self.hud_overlay.level = self.level
+        self.minigame = None
+        self.drawn = {}
+        logger.info("Entered level %d", self.campaign.current + 1)
+
+    def _minigame_input(self, event):
+        self.minigame.input()
+
+    def _add_item(self, event):
+        self.minigame.add_item()
+
+    def update(self):
+        if self.state == State.MINIGAME:
+            with TRACER.span("minigame.update"):
+                self.minigame.update()
+
+    def render(self, screen):
+        """
+        Redraw only the parts of the screen that changed since the last call
+        and return the changed rectangles. Nothing is drawn and an empty list
+        is returned if the frame would look the same as the previous one.
+        """
+        layers = self._layers()
+
+        dirty = []
+        for name, (signature, rect) in layers.items():
+            if signature is None or self.drawn.get(name) != (signature, rect):
+                dirty.append(rect)
+                if name in self.drawn:
+                    dirty.append(self.drawn[name][1])
+        for name, (_, rect) in self.drawn.items():
+            if name not in layers:
+                dirty.append(rect)
+        dirty = list(dict.fromkeys(map(tuple, dirty)))
+
+        self.drawn = layers
+
+        if self.SCREEN_RECT in dirty:
+            self.draw(screen)
+            return [self.SCREEN_RECT]
+
+        dirty = [pygame.Rect(rect) for rect in dirty]
+        for rect in dirty:
+            screen.set_clip(rect)
+            self.draw(screen)
+        screen.set_clip(None)
+
+        return dirty
+
+    def draw(self, screen):
+        screen.fill((0, 0, 0))
 
-            elif event.type == CustomEvent.LEVEL_CLEARED.value:
-                state = State.LEVEL_CLEARED
-                text_overlay.set_text("LEVEL CLEARED!\n\n" + event.text, color="green")
+        with TRACER.span("level.render"):
+            self.level.render(screen, bob=self.bob)
 
-            elif event.type == CustomEvent.ENTITY_BOB.value:
-                bob = not bob
+        with TRACER.span("torchlight_overlay.render"):
+            self.torchlight_overlay.render(screen)
 
-            if state == State.RUNNING:
-                if event.type == pygame.KEYDOWN:
-                    if event.key in MOVEMENT_CONTROLS:
-                        level.handle_movement(MOVEMENT_CONTROLS[event.key])
+        if self.state in (State.OVERLAY, State.GAME_OVER, State.LEVEL_CLEARED):
+            with TRACER.span("text_overlay.render"):
+                self.text_overlay.render(screen)
 
-                elif event.type == CustomEvent.REGENERATE_TORCHLIGHT.value:
-                    torchlight_overlay.generate()
+        elif self.state == State.MINIGAME:
+            with TRACER.span("minigame.render"):
+                self.minigame.render(screen)
 
-                elif event.type == CustomEvent.SHOW_TEXT.value:
-                    state = State.OVERLAY
-                    text_overlay.set_text(
-                        event.text,
-                        color=getattr(event, "color", None),
-                    )
+        if not self.bob or not self.hud_overlay.should_blink:
+            with TRACER.span("hud_overlay.render"):
+                self.hud_overlay.render(screen)
 
-                elif event.type == CustomEvent.KEY_PICKED_UP.value:
-                    level.remove_entity(event.entity)
+    def _layers(self):
+        """Signature and screen area of everything `draw` would draw."""
+        layers = {
+            "level": ((self.level.signature, self.bob), self.SCREEN_RECT),
+            "torchlight": (self.torchlight_overlay.signature, self.SCREEN_RECT),
+        }
 
-                elif event.type == CustomEvent.COFFEE_PICKED_UP.value:
-                    level.remove_entity(event.entity)
-                    level.player.replenish_health()
+        if self.state in (State.OVERLAY, State.GAME_OVER, State.LEVEL_CLEARED):
+            layers["text"] = (self.text_overlay.signature, self.text_overlay.rect)
 
-                elif event.type == CustomEvent.DOOR_OPENED.value:
-                    level.remove_entity(event.entity)
+        elif self.state == State.MINIGAME:
+            layers["minigame"] = (self.minigame.signature, self.minigame.rect)
 
-            elif state == State.OVERLAY:
-                if event.type == pygame.KEYDOWN:
-                    state = State.RUNNING
-                    text_overlay.dismiss()
+        if not self.bob or not self.hud_overlay.should_blink:
+            layers["hud"] = (self.hud_overlay.signature, self.hud_overlay.rect)
 
-                    if minigame is not None and not minigame.started:
-                        state = State.MINIGAME
-                        minigame.start()
+        return layers
 
-            elif state == State.MINIGAME:
-                if event.type == pygame.KEYDOWN:
-                    minigame.input()
-                elif event.type == CustomEvent.COLOR_MINIGAME_ADD_ITEM.value:
-                    minigame.add_item()
 
-        if state == State.MINIGAME:
-            minigame.update()
+def run(dirty_rects=True, trace=None):
+    """
+    Run the game in a window. With `dirty_rects` only the changed parts of
+    the screen are redrawn and presented, otherwise every frame is redrawn
+    in full and flipped.
 
-        screen.fill((0, 0, 0))
+    With `trace` (or the GAME_TRACE environment variable) set to a path, the
+    phases of every frame are traced and written there when the game exits
+    or when TRACE_KEY is pressed.
 
-        level.render(screen, bob=bob)
+    PERF_KEY toggles the performance overlay. With the GAME_PERF_CSV
+    environment variable set to a path, frame stats are collected even while
+    the overlay is hidden and the last ones are written there on exit.
 
-        torchlight_overlay.render(screen)
+    The levels of `CAMPAIGN` are played in order. GAME_SEED seeds the
+    game's RNG. With GAME_RECORD set to a path, the key
+    presses are recorded there on exit, to be replayed by `headless.py
+    --replay`.
+    """
+    seed = os.environ.get("GAME_SEED")
+    RNG.seed(int(seed) if seed is not None else None)
+    record = os.environ.get("GAME_RECORD")
+    fps = int(os.environ.get("GAME_FPS", FPS))
 
-        if state in (State.OVERLAY, State.GAME_OVER, State.LEVEL_CLEARED):
-            text_overlay.render(screen)
+    trace = trace or os.environ.get("GAME_TRACE")
+    perf_csv = os.environ.get("GAME_PERF_CSV")
+    stats = FrameStats()
+    perf = PerformanceOverlay(stats)
+    TRACER.enable(bool(trace or perf_csv))
 
-        elif state == State.MINIGAME:
-            minigame.render(screen)
+    with STARTUP.phase("display"):
+        # the mixer is initialized separately, in the background
+        pygame.display.init()
+        pygame.font.init()
 
-        if not bob or not hud_overlay.should_blink:
-            hud_overlay.render(screen)
+        logger.debug("Setting window size to %d x %d", WINDOW_WIDTH, WINDOW_HEIGHT)
 
+        screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+        pygame.display.set_caption(GAME_TITLE)
         pygame.display.flip()
 
-        clock.tick(60)
-
+    SOUNDS.load_async()
+
+    with STARTUP.phase("atlas"):
+        ASSETS.build()
+
+    with STARTUP.phase("level"):
+        campaign = Campaign(CAMPAIGN)
+        game = Game(campaign=campaign)
+
+    recording = None
+    if record:
+        recording = InputRecording(RNG.value, None, None, campaign=CAMPAIGN)
+
+    pacer = FramePacer(fps)
+    SOUNDS.play()
+    game.start()
+    STARTUP.done()
+    reported = False
+    millis = 0
+
+    while game.running:
+        if recording is not None:
+            recording.begin_tick(millis)
+
+        with TRACER.span("frame"):
+            with TRACER.span("events"):
+                for event in pacer.events():
+                    if event.type == pygame.KEYDOWN and event.key == TRACE_KEY:
+                        if trace:
+                            dump_trace(trace)
+                    elif event.type == pygame.KEYDOWN and event.key == PERF_KEY:
+                        perf.toggle()
+                        stats.clear()
+                        TRACER.enable(bool(trace or perf_csv or perf.visible))
+                        # redraw everything to show or clear the overlay area
+                        game.drawn = {}
+                    else:
+                        if recording is not None and event.type == pygame.KEYDOWN:
+                            recording.key(event.key)
+                        game.handle_event(event)
+
+                # events posted while handling are delivered on the same frame
+                while BUS.deliver():
+                    pass
+
+            game.update()
+
+            if dirty_rects:
+                with TRACER.span("render"):
+                    rects = game.render(screen)
+                if perf.visible:
+                    with TRACER.span("perf_overlay.render"):
+                        perf.render(screen)
+                    rects.append(perf.rect)
+                if rects:
+                    with TRACER.span("display.flip"):
+                        pygame.display.update(rects)
+            else:
+                with TRACER.span("render"):
+                    game.draw(screen)
+                if perf.visible:
+                    with TRACER.span("perf_overlay.render"):
+                        perf.render(screen)
+                with TRACER.span("display.flip"):
+                    pygame.display.flip()
+
+        if not reported and SOUNDS.loaded:
+            logger.info(STARTUP.report())
+            reported = True
+
+        # the performance overlay's graph scrolls every frame, and a game
+        # that was quit shouldn't wait for its next timer to exit
+        millis = pacer.tick(game.animating or perf.visible or not game.running)
+        TIMERS.advance(millis)
+
+        if TRACER.enabled:
+            stats.end_frame(millis)
+            if perf.visible:
+                perf.update()
+
+    if recording is not None:
+        recording.outcome = game.state.name
+        recording.save(record)
+        logger.info("Recorded %d ticks to %s", recording.ticks, record)
+    if trace:
+        dump_trace(trace)
+    if perf_csv:
+        stats.write_csv(perf_csv)
+        logger.info("Wrote %d frames of stats to %s", len(stats.rows), perf_csv)
+
+    campaign.close()
     pygame.quit()
+
+
+def dump_trace(path):
+    count = TRACER.dump(path)
+    logger.info("Wrote %d trace spans to %s", count, path)
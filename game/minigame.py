@@ -1,12 +1,14 @@
 import logging
 import math
-import random
 
+import numpy
 import pygame
 
 from game.assets import TEXTS
 from game.consts import WINDOW_HEIGHT, WINDOW_WIDTH
 from game.events import CustomEvent
+from game.rng import RNG
+from game.tracing import TRACER
 from game.utils import post_event
 
 
@@ -14,9 +16,22 @@ logger = logging.getLogger(__name__)
 
 
 class Minigame:
+    """
+    Minigame box drawn from persistent layers.
+
+    The chrome (padding, description and enemy health) is redrawn only when
+    the health changes. Subclasses draw the play area onto `content`, in
+    `_render_minigame`, which is only called when `_content_key` changes.
+    Flashes and blurbs are transient effects applied while compositing and
+    jitter just moves the box. Layers are only recomposited onto
+    `surface_with_padding` when one of them changed.
+    """
+
     PADDING = 5
     MAX_JITTER = 30
     FONT_SIZE = 16
+    # how often `add_item` is called while the minigame runs, if at all
+    ADD_ITEM_MILLIS = None
 
     DARKBLUE = (39, 39, 68)
     PURPLE = (139, 109, 156)
@@ -31,6 +46,7 @@ class Minigame:
         self.flashes = 0
         self.blurb = None
         self.blurb_show = 0
+        self.offset = (0, 0)
 
         self.surface_with_padding = pygame.surface.Surface((self.width, self.height))
         self.surface = self.surface_with_padding.subsurface(
@@ -39,6 +55,14 @@ class Minigame:
             self.surface_with_padding.get_width() - self.PADDING * 2,
             self.surface_with_padding.get_height() - self.PADDING * 10,
         )
+        self.chrome = pygame.Surface(self.surface_with_padding.get_size())
+        self.content = pygame.Surface(self.surface.get_size())
+        self.content.fill(self.BG)
+
+        # what each layer and the composited frame were last drawn for
+        self.chrome_key = None
+        self.content_key = None
+        self.composited = None
 
         logger.debug("Minigame for enemy %s at %d %d created", enemy.type, *enemy.pos)
 
@@ -54,6 +78,23 @@ class Minigame:
     def description(self):
         return None
 
+    @property
+    def rect(self):
+        return pygame.Rect(
+            (WINDOW_WIDTH - self.width) // 2 + self.offset[0],
+            (WINDOW_HEIGHT - self.height) // 2 + self.offset[1],
+            self.width,
+            self.height,
+        )
+
+    @property
+    def signature(self):
+        return (self.offset, self._frame_key())
+
+    @property
+    def rng(self):
+        return RNG.stream("minigame")
+
     def start(self):
         self.started = True
         logger.debug("Minigame started")
@@ -61,63 +102,79 @@ class Minigame:
     def update(self):
         if self.flashes > 0:
             self.flashes -= 1
+        if self.blurb_show > 0:
+            self.blurb_show -= 1
         if self.jitters > 0:
             self.jitters -= 1
+            self.offset = (
+                self.rng.randint(-self.MAX_JITTER, self.MAX_JITTER),
+                self.rng.randint(-self.MAX_JITTER, self.MAX_JITTER),
+            )
+        else:
+            self.offset = (0, 0)
 
     def render(self, screen):
-        self.surface_with_padding.fill("white")
+        frame_key = self._frame_key()
+        if frame_key != self.composited:
+            self._composite(frame_key)
+            self.composited = frame_key
+
+        screen.blit(self.surface_with_padding, self.rect)
+        TRACER.count("blits")
+
+    def _frame_key(self):
+        chrome_key = self.enemy.health
+        if chrome_key != self.chrome_key:
+            self._render_chrome()
+            self.chrome_key = chrome_key
+
+        content_key = self._content_key()
+        if content_key != self.content_key:
+            self._render_minigame()
+            self.content_key = content_key
+
+        blurb = self.blurb_surface if self.blurb and self.blurb_show > 0 else None
+        return (chrome_key, content_key, self.flashes > 0, blurb and self.blurb_pos)
+
+    def _composite(self, frame_key):
+        self.surface_with_padding.blit(self.chrome, (0, 0))
         if self.flashes > 0:
             self.surface.fill("white")
         else:
-            self.surface.fill(self.BG)
-
-        self._render_minigame()
-        self._render_description()
-        self._render_enemy_health()
-        self._render_blurb()
+            self.surface.blit(self.content, (0, 0))
+        TRACER.count("blits", 2)
 
-        left = (WINDOW_WIDTH - self.width) // 2
-        top = (WINDOW_HEIGHT - self.height) // 2
-        if self.jitters > 0:
-            top += random.randint(-self.MAX_JITTER, self.MAX_JITTER)
-            left += random.randint(-self.MAX_JITTER, self.MAX_JITTER)
+        if self.blurb and self.blurb_show > 0:
+            self.surface.blit(self.blurb_surface, self.blurb_pos)
+            TRACER.count("blits")
 
-        screen.blit(self.surface_with_padding, (left, top))
+    def _content_key(self):
+        """Changes whenever `content` has to be redrawn."""
+        raise NotImplementedError
 
     def _render_minigame(self):
+        """Bring `content` up to date."""
         raise NotImplementedError
 
-    def _render_description(self):
-        if self.description:
-            font = TEXTS.get_font(self.FONT_SIZE)
-            font_surface = font.render(self.description, False, "black")
-            self.surface_with_padding.blit(
-                font_surface,
-                (
-                    self.PADDING,
-                    self.PADDING,
-                ),
-            )
+    def _render_chrome(self):
+        self.chrome.fill("white")
 
-    def _render_enemy_health(self):
-        font = TEXTS.get_font(self.FONT_SIZE)
-        font_surface = font.render(f"Bug health: {self.enemy.health}", False, "black")
+        if self.description:
+            font_surface = TEXTS.render(self.description, self.FONT_SIZE, "black")
+            self.chrome.blit(font_surface, (self.PADDING, self.PADDING))
+            TRACER.count("blits")
 
-        self.surface_with_padding.blit(
+        font_surface = TEXTS.render(
+            f"Bug health: {self.enemy.health}", self.FONT_SIZE, "black"
+        )
+        self.chrome.blit(
             font_surface,
             (
                 self.PADDING,
-                self.surface_with_padding.get_height() - self.FONT_SIZE - self.PADDING,
+                self.chrome.get_height() - self.FONT_SIZE - self.PADDING,
             ),
         )
-
-    def _render_blurb(self):
-        if self.blurb and self.blurb_show > 0:
-            self.surface.blit(
-                self.blurb_surface,
-                self.blurb_pos,
-            )
-            self.blurb_show -= 1
+        TRACER.count("blits")
 
     def set_blurb(self, blurb, good):
         self.blurb = blurb
@@ -127,13 +184,12 @@ class Minigame:
         else:
             self.blurb_color = "red"
 
-        font = TEXTS.get_font(self.FONT_SIZE)
-        self.blurb_surface = font.render(self.blurb, False, self.blurb_color)
+        self.blurb_surface = TEXTS.render(self.blurb, self.FONT_SIZE, self.blurb_color)
         self.blurb_pos = (
-            random.randint(
+            self.rng.randint(
                 0, self.surface.get_width() - self.blurb_surface.get_width()
             ),
-            random.randint(
+            self.rng.randint(
                 0, self.surface.get_height() - self.blurb_surface.get_height()
             ),
         )
@@ -161,20 +217,17 @@ class PrecisionMinigame(Minigame):
 
         self.pos = (self.pos + min(self.difficulty, 4)) % self.surface_width
 
+    def _content_key(self):
+        return self.pos
+
     def _render_minigame(self):
-        pygame.draw.rect(
-            self.surface,
-            self.PURPLE,
-            (
-                (self.surface_width - self.target_width) // 2,
-                0,
-                self.target_width,
-                self.surface.get_height(),
-            ),
-        )
-        pygame.draw.rect(
-            self.surface, self.DARKBLUE, (self.pos, 0, 2, self.surface.get_height())
-        )
+        # erase the bar where it was last drawn, then draw it again
+        height = self.content.get_height()
+        if self.bar_pos is not None:
+            area = pygame.Rect(self.bar_pos, 0, 2, height)
+            self.content.blit(self.track, area, area)
+        pygame.draw.rect(self.content, self.DARKBLUE, (self.pos, 0, 2, height))
+        self.bar_pos = self.pos
 
     def input(self):
         if (
@@ -187,7 +240,7 @@ class PrecisionMinigame(Minigame):
             post_event(CustomEvent.DAMAGE_RECEIVED, enemy=self.enemy)
 
     def reset(self):
-        self.pos = random.randint(0, self.surface_width)
+        self.pos = self.rng.randint(0, self.surface_width)
 
     def start(self):
         self.pos = 0
@@ -202,6 +255,21 @@ class PrecisionMinigame(Minigame):
             self.target_width,
         )
 
+        self.track = pygame.Surface(self.content.get_size())
+        self.track.fill(self.BG)
+        pygame.draw.rect(
+            self.track,
+            self.PURPLE,
+            (
+                (self.surface_width - self.target_width) // 2,
+                0,
+                self.target_width,
+                self.track.get_height(),
+            ),
+        )
+        self.content.blit(self.track, (0, 0))
+        self.bar_pos = None
+
 
 class FlashMinigame(Minigame):
     def __init__(self, *args, **kwargs):
@@ -218,7 +286,7 @@ class FlashMinigame(Minigame):
         if self.active_timer > 0:
             self.active_timer -= 1
             if self.active_timer == 0:
-                self.cooldown = random.randint(50, 100)
+                self.cooldown = self.rng.randint(50, 100)
                 post_event(CustomEvent.DAMAGE_RECEIVED, enemy=self.enemy)
 
         elif self.cooldown > 0:
@@ -227,9 +295,11 @@ class FlashMinigame(Minigame):
         elif self.cooldown == 0:
             self.active_timer = 60 - self.difficulty * 2
 
+    def _content_key(self):
+        return self.active_timer > 0
+
     def _render_minigame(self):
-        if self.active_timer > 0:
-            self.surface.fill(self.PURPLE)
+        self.content.fill(self.PURPLE if self.active_timer > 0 else self.BG)
 
     def input(self):
         if self.active_timer > 0:
@@ -239,24 +309,37 @@ class FlashMinigame(Minigame):
 
     def reset(self):
         self.active_timer = 0
-        self.cooldown = random.randint(200, 500)
+        self.cooldown = self.rng.randint(200, 500)
 
     def start(self):
         logger.debug("FlashMinigame difficulty is %d.", self.difficulty)
 
 
 class ColorMinigame(Minigame):
+    ADD_ITEM_MILLIS = 750
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # pixels covered by circles so far, nonzero where purple
+        self.coverage = pygame.Surface(self.surface.get_size())
+        self.resets = 0
         self.reset()
 
     @property
     def description(self):
         return "More purple than yellow?"
 
+    def _content_key(self):
+        return (self.resets, self.item_count)
+
     def _render_minigame(self):
-        for item in self.items:
-            pygame.draw.circle(*item)
+        # only circles added since the last call are drawn
+        if self.cleared:
+            self.content.fill(self.BG)
+            self.cleared = False
+        for center, radius in self.items:
+            pygame.draw.circle(self.content, self.PURPLE, center, radius)
+        self.items = []
 
     def input(self):
         if self.ratio > 1:
@@ -265,9 +348,15 @@ class ColorMinigame(Minigame):
             post_event(CustomEvent.DAMAGE_RECEIVED, enemy=self.enemy)
 
     def reset(self):
+        # circles not drawn onto the content layer yet
         self.items = []
+        self.item_count = 0
+        self.resets += 1
+        self.cleared = True
         self.ratio = 0
         self.reset_pending = False
+        self.coverage.fill((0, 0, 0))
+        self.covered = 0
 
     def start(self):
         logger.debug("ColorMinigame difficulty is %d.", self.difficulty)
@@ -284,28 +373,42 @@ class ColorMinigame(Minigame):
             post_event(CustomEvent.DAMAGE_RECEIVED, enemy=self.enemy)
             self.reset()
 
-        self.items.append(
-            (
-                self.surface,
-                self.PURPLE,
-                (
-                    random.randint(0, self.surface.get_width()),
-                    random.randint(0, self.surface.get_height()),
-                ),
-                random.randint(25, self.surface.get_height() // 3),
-            )
+        center = (
+            self.rng.randint(0, self.surface.get_width()),
+            self.rng.randint(0, self.surface.get_height()),
         )
-        self._render_minigame()
+        radius = self.rng.randint(25, self.surface.get_height() // 3)
+        self.items.append((center, radius))
+        self.item_count += 1
+
+        self._cover(center, radius)
         self.ratio = self._calculate_ratio()
 
+    def _cover(self, center, radius):
+        """
+        Draw a circle onto the coverage surface and count the newly covered
+        pixels. Only the circle's bounding box is inspected.
+        """
+        area = pygame.Rect(
+            center[0] - radius - 1,
+            center[1] - radius - 1,
+            radius * 2 + 3,
+            radius * 2 + 3,
+        ).clip(self.coverage.get_rect())
+
+        before = self._count_covered(area)
+        pygame.draw.circle(self.coverage, self.PURPLE, center, radius)
+        self.covered += self._count_covered(area) - before
+
+    def _count_covered(self, area):
+        pixels = pygame.surfarray.pixels2d(self.coverage)
+        count = numpy.count_nonzero(
+            pixels[area.left : area.right, area.top : area.bottom]
+        )
+        # release the lock on the surface
+        del pixels
+        return count
+
     def _calculate_ratio(self):
-        white = 0
-        purple = 0
-        for y in range(self.surface.get_height()):
-            for x in range(self.surface.get_width()):
-                if self.surface.get_at((x, y)) == self.PURPLE:
-                    purple += 1
-                else:
-                    white += 1
-
-        return purple / white
+        total = self.coverage.get_width() * self.coverage.get_height()
+        return self.covered / (total - self.covered)
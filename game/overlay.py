@@ -1,15 +1,18 @@
-import random
+import re
 
+import numpy
 import pygame
 
 from game.assets import TEXTS
 from game.consts import (
-    TILE_COLS,
     TILE_ROWS,
     TILE_SIZE_PIXELS,
     WINDOW_HEIGHT,
     WINDOW_WIDTH,
 )
+from game.level.types import EntityType
+from game.rng import RNG
+from game.tracing import TRACER
 
 
 class HUDOverlay:
@@ -23,90 +26,352 @@ class HUDOverlay:
     def should_blink(self):
         return self.level.player.health <= 1
 
+    @property
+    def signature(self):
+        return self.level.player.health
+
+    @property
+    def rect(self):
+        return self._surface().get_rect(topleft=(self.PADDING, self.PADDING))
+
     def render(self, screen):
-        font = TEXTS.get_font(self.FONT_SIZE)
+        screen.blit(self._surface(), (self.PADDING, self.PADDING))
+        TRACER.count("blits")
+
+    def _surface(self):
         if self.level.player.health > 1:
             color = (242, 211, 171)
         else:
             color = (200, 0, 0)
-        font_surface = font.render(
-            f"Energy left: {self.level.player.health}", False, color
+        return TEXTS.render(
+            f"Energy left: {self.level.player.health}", self.FONT_SIZE, color
+        )
+
+
+class PerformanceOverlay:
+    """
+    Toggleable panel with frame rate, frame time percentiles, phase costs
+    and per-frame counters from `FrameStats`, plus a rolling graph of the
+    work time of each frame against the frame budget.
+
+    The graph is scrolled by a pixel per frame and the text is re-rendered
+    only every `REFRESH_FRAMES` frames, so showing the panel costs a single
+    blit most frames. None of its own drawing is traced or counted.
+    """
+
+    FONT_SIZE = 16
+    PADDING = 16
+    LINE_HEIGHT = 18
+    LINES = 4
+    WIDTH = 300
+    GRAPH_HEIGHT = 48
+    REFRESH_FRAMES = 15
+    BACKGROUND = (20, 20, 20)
+    BUDGET_MILLIS = 1000 / 60
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.visible = False
+        self.frames = 0
+
+        text_height = self.LINES * self.LINE_HEIGHT
+        self.surface = pygame.Surface(
+            (self.WIDTH, text_height + self.GRAPH_HEIGHT + 8)
+        )
+        self.surface.fill(self.BACKGROUND)
+        self.graph = self.surface.subsurface(
+            (4, text_height + 4, self.WIDTH - 8, self.GRAPH_HEIGHT)
+        )
+
+    @property
+    def rect(self):
+        return self.surface.get_rect(
+            topright=(WINDOW_WIDTH - self.PADDING, self.PADDING)
         )
 
-        screen.blit(font_surface, (self.PADDING, self.PADDING))
+    def toggle(self):
+        self.visible = not self.visible
+        self.frames = 0
+
+    def update(self):
+        """Add the frame that `stats` collected last."""
+        last = self.stats.last
+        if last is None:
+            return
+
+        self._plot(last["work_ms"])
+        if self.frames % self.REFRESH_FRAMES == 0:
+            self._write()
+        self.frames += 1
+
+    def render(self, screen):
+        screen.blit(self.surface, self.rect)
+
+    def _plot(self, millis):
+        self.graph.scroll(-1, 0)
+        width, height = self.graph.get_size()
+        scale = height / (2 * self.BUDGET_MILLIS)
+
+        column = pygame.Rect(width - 1, 0, 1, height)
+        self.graph.fill(self.BACKGROUND, column)
+        bar = min(int(millis * scale), height)
+        color = (80, 200, 80) if millis <= self.BUDGET_MILLIS else (220, 60, 60)
+        self.graph.fill(color, (width - 1, height - bar, 1, bar))
+        budget = height - int(self.BUDGET_MILLIS * scale)
+        self.graph.set_at((width - 1, budget), "white")
+
+    def _write(self):
+        p50, p95, p99 = self.stats.percentiles("frame_ms")
+        means = self.stats.means()
+        lines = [
+            f"FPS {self.stats.fps():5.1f}   work {means['work_ms']:5.2f} ms",
+            f"frame p50 {p50:5.1f} p95 {p95:5.1f} p99 {p99:5.1f} ms",
+            f"level {means['level']:4.2f} overlays {means['overlays']:4.2f} "
+            f"minigame {means['minigame']:4.2f} ms",
+            f"blits {means['blits']:5.1f} surfaces {means['surfaces']:4.1f} /frame",
+        ]
+
+        # the font is used directly so the numbers don't churn the text cache
+        font = TEXTS.get_font(self.FONT_SIZE)
+        self.surface.fill(
+            self.BACKGROUND, (0, 0, self.WIDTH, self.LINES * self.LINE_HEIGHT + 4)
+        )
+        for i, line in enumerate(lines):
+            self.surface.blit(
+                font.render(line, False, "white", self.BACKGROUND),
+                (6, 4 + i * self.LINE_HEIGHT),
+            )
 
 
 class TextOverlay:
+    """
+    Box of text in the middle of the screen.
+
+    The text is word wrapped to fit the box and composited onto a surface
+    once, in `set_text`, so drawing the overlay is a single blit until the
+    text changes. Besides a string, `set_text` takes a sequence of
+    (text, color) spans; spans without a color use the overlay's color.
+    """
+
     FONT_SIZE = 32
 
     def __init__(self, color=None):
         self.color = color or "white"
+        self.spans = ()
+        self.surface = None
 
     @property
     def width(self):
         return WINDOW_WIDTH - WINDOW_WIDTH // 2
 
+    @property
+    def height(self):
+        return self.surface.get_height()
+
+    @property
+    def signature(self):
+        return (self.spans, self.color)
+
+    @property
+    def rect(self):
+        return pygame.Rect(
+            (WINDOW_WIDTH - self.width) // 2,
+            (WINDOW_HEIGHT - self.height) // 2,
+            self.width,
+            self.height,
+        )
+
     def set_text(self, text, color=None):
-        self.text = text
+        if isinstance(text, str):
+            text = [(text, None)]
+        self.spans = tuple((span, span_color) for span, span_color in text)
         self.color = color or "white"
+        self.surface = self._composite(self._layout())
 
     def dismiss(self):
-        self.text = None
+        self.spans = ()
         self.color = "white"
+        self.surface = None
 
     def render(self, screen):
+        screen.blit(self.surface, self.rect)
+        TRACER.count("blits")
+
+    def _layout(self):
+        """
+        Break the spans into lines no wider than the box, each a list of
+        (text, color) fragments. Lines only break at spaces, which are
+        dropped at the break, and at newlines.
+        """
         font = TEXTS.get_font(self.FONT_SIZE)
+        max_width = self.width - 2 * self.FONT_SIZE
 
-        font_surfaces = []
-        for line in self.text.split("\n"):
-            surface = font.render(line, False, self.color)
-            font_surfaces.append(
-                (
-                    surface,
-                    (
-                        self.FONT_SIZE,
-                        self.FONT_SIZE + self.FONT_SIZE * len(font_surfaces),
-                    ),
-                )
-            )
+        lines = [[]]
+        line_width = 0
+        spaces = ""
+        for text, color in self.spans:
+            color = color or self.color
+            for i, paragraph in enumerate(text.split("\n")):
+                if i > 0:
+                    lines.append([])
+                    line_width = 0
+                    spaces = ""
 
-        overlay = pygame.Surface(
-            (self.width, font_surfaces[-1][1][1] + 2 * self.FONT_SIZE)
-        )
-        overlay.blits(font_surfaces)
-
-        screen.blit(
-            overlay,
-            (
-                (WINDOW_WIDTH - self.width) // 2,
-                (WINDOW_HEIGHT - overlay.get_height()) // 2,
-            ),
-        )
+                for token in re.findall(r" +|[^ ]+", paragraph):
+                    if token[0] == " ":
+                        spaces += token
+                        continue
+
+                    width = font.size(spaces + token)[0]
+                    if lines[-1] and line_width + width > max_width:
+                        lines.append([])
+                        line_width = 0
+                        spaces = ""
+                        width = font.size(token)[0]
+
+                    self._append(lines[-1], spaces + token, color)
+                    line_width += width
+                    spaces = ""
+
+        return lines
+
+    @staticmethod
+    def _append(line, text, color):
+        """Add text to a line, merging it into the last fragment if it can."""
+        if line and line[-1][1] == color:
+            line[-1] = (line[-1][0] + text, color)
+        else:
+            line.append((text, color))
+
+    def _composite(self, lines):
+        font = TEXTS.get_font(self.FONT_SIZE)
+        surface = pygame.Surface((self.width, self.FONT_SIZE * (len(lines) + 2)))
+        TRACER.count("surfaces")
+
+        for i, line in enumerate(lines):
+            left = self.FONT_SIZE
+            top = self.FONT_SIZE + self.FONT_SIZE * i
+            for text, color in line:
+                if text:
+                    surface.blit(font.render(text, False, color), (left, top))
+                left += font.size(text)[0]
+
+        return surface
 
 
 class TorchlightOverlay:
-    def __init__(self):
-        self.generate()
+    """
+    Darkness around the player as a single per-pixel alpha light map.
+
+    A small ring of flicker variants is computed with numpy the first time
+    the overlay is drawn, so games that never render don't pay for it, and
+    `generate` just moves on to the next one. Entities such as coffee or the
+    exit give off light of their own. The light map is only recomposited
+    when the variant or the visible light sources change.
+    """
+
+    FLICKER_VARIANTS = 8
+    INNER_RADIUS = TILE_SIZE_PIXELS // 2
+    OUTER_RADIUS = TILE_SIZE_PIXELS * (TILE_ROWS // 2) + TILE_SIZE_PIXELS // 2
+    LIGHT_RADIUS = TILE_SIZE_PIXELS * 3 // 2
+    LIGHT_SOURCES = (EntityType.COFFEE, EntityType.WIN)
+
+    def __init__(self, level=None):
+        self.level = level
+        # built by `_prepare` on the first render
+        self.surface = None
+        self.variants = None
+        self.light = None
+
+        self.current = 0
+        self.key = None
+
+    @property
+    def signature(self):
+        return (self.current, self._light_sources())
 
     def generate(self):
-        # XXX make this better
-        overlays = []
-
-        max_dist = TILE_ROWS // 2
-        for r in range(TILE_ROWS):
-            for c in range(TILE_COLS):
-                dist_to_center = max(abs(r - TILE_ROWS // 2), abs(c - TILE_COLS // 2))
-                surface = pygame.Surface((TILE_SIZE_PIXELS, TILE_SIZE_PIXELS))
-                degree = 255 // max_dist
-                surface.set_alpha(degree * dist_to_center + random.randint(-10, 10))
-                overlays.append(
-                    (
-                        surface,
-                        (c * TILE_SIZE_PIXELS, r * TILE_SIZE_PIXELS),
-                    )
-                )
-
-        self.overlays = overlays
+        self.current = (self.current + 1) % self.FLICKER_VARIANTS
 
     def render(self, screen):
-        screen.blits(self.overlays)
+        if self.surface is None:
+            self._prepare()
+
+        key = self.signature
+        if key != self.key:
+            self._composite(*key)
+            self.key = key
+
+        screen.blit(self.surface, (0, 0))
+        TRACER.count("blits")
+
+    def _prepare(self):
+        self.surface = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SRCALPHA)
+
+        distance = self._distance(WINDOW_WIDTH, WINDOW_HEIGHT)
+        self.variants = [self._variant(distance) for _ in range(self.FLICKER_VARIANTS)]
+        size = self.LIGHT_RADIUS * 2
+        self.light = self._falloff(
+            self._distance(size, size), 0, self.LIGHT_RADIUS
+        ).astype(numpy.uint8)
+
+    def _distance(self, width, height):
+        """Distance of every pixel to the centre, indexed as [x, y]."""
+        x = numpy.arange(width, dtype=numpy.float32) - (width - 1) / 2
+        y = numpy.arange(height, dtype=numpy.float32) - (height - 1) / 2
+        return numpy.hypot(x[:, None], y[None, :])
+
+    def _falloff(self, distance, inner, outer):
+        return numpy.clip((distance - inner) / (outer - inner), 0, 1) * 255
+
+    def _variant(self, distance):
+        rng = RNG.stream("torchlight")
+        outer = self.OUTER_RADIUS * rng.uniform(0.95, 1.05)
+        alpha = self._falloff(distance, self.INNER_RADIUS, outer)
+        alpha += rng.uniform(-10, 10)
+        return numpy.clip(alpha, 0, 255).astype(numpy.uint8)
+
+    def _light_sources(self):
+        if self.level is None:
+            return ()
+
+        top_left = self.level.top_left
+        margin = self.LIGHT_RADIUS // TILE_SIZE_PIXELS + 1
+        sources = []
+        for entity in self.level.visible_entities(margin):
+            if entity.type not in self.LIGHT_SOURCES:
+                continue
+            if not self.level.fov.visible(entity.row, entity.col):
+                continue
+            x = (entity.col - top_left[1]) * TILE_SIZE_PIXELS + TILE_SIZE_PIXELS // 2
+            y = (entity.row - top_left[0]) * TILE_SIZE_PIXELS + TILE_SIZE_PIXELS // 2
+            if (
+                -self.LIGHT_RADIUS < x < WINDOW_WIDTH + self.LIGHT_RADIUS
+                and -self.LIGHT_RADIUS < y < WINDOW_HEIGHT + self.LIGHT_RADIUS
+            ):
+                sources.append((x, y))
+
+        return tuple(sources)
+
+    def _composite(self, current, sources):
+        alpha = pygame.surfarray.pixels_alpha(self.surface)
+        alpha[...] = self.variants[current]
+
+        for x, y in sources:
+            left = x - self.LIGHT_RADIUS
+            top = y - self.LIGHT_RADIUS
+            screen_area = pygame.Rect(left, top, *self.light.shape).clip(
+                self.surface.get_rect()
+            )
+            target = alpha[
+                screen_area.left : screen_area.right,
+                screen_area.top : screen_area.bottom,
+            ]
+            light = self.light[
+                screen_area.left - left : screen_area.right - left,
+                screen_area.top - top : screen_area.bottom - top,
+            ]
+            numpy.minimum(target, light, out=target)
+
+        # release the lock on the surface
+        del alpha
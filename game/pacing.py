@@ -0,0 +1,44 @@
+import math
+
+import pygame
+
+from game.timers import TIMERS
+
+
+class FramePacer:
+    """
+    Frame rate limiter for `run` that sleeps while nothing is animating.
+
+    An animating frame is followed by the next one as soon as the `fps`
+    cap allows. Otherwise the screen can only change on input or when a
+    timer is due, so `tick` blocks in `pygame.event.wait` until one of
+    those happens. The event that ended the wait is handed out first by
+    the next `events` call.
+    """
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.clock = pygame.time.Clock()
+        self.pending = []
+        self.idle_frames = 0
+
+    def events(self):
+        """Events to handle this frame, oldest first."""
+        events = self.pending + pygame.event.get()
+        self.pending = []
+        return events
+
+    def tick(self, animating):
+        """Wait for the next frame and return the milliseconds it took."""
+        if not animating:
+            self.idle_frames += 1
+            until_next = TIMERS.until_next()
+            if until_next is None:
+                event = pygame.event.wait()
+            else:
+                # a timeout of 0 would wait forever
+                event = pygame.event.wait(max(math.ceil(until_next), 1))
+            if event.type != pygame.NOEVENT:
+                self.pending.append(event)
+
+        return self.clock.tick(self.fps)
@@ -0,0 +1,87 @@
+import collections
+import csv
+
+import numpy
+
+from game.tracing import TRACER
+
+
+class FrameStats:
+    """
+    Rolling statistics over the last `window` frames: frame time, the cost
+    of the traced phases and the tracer's counters.
+
+    Phase costs are read back from the spans `TRACER` recorded during the
+    frame, so tracing has to be enabled while stats are collected.
+    """
+
+    PHASES = {
+        "level": ("level.render",),
+        "overlays": (
+            "torchlight_overlay.render",
+            "text_overlay.render",
+            "hud_overlay.render",
+        ),
+        "minigame": ("minigame.update", "minigame.render"),
+    }
+    COUNTERS = ("blits", "surfaces")
+
+    def __init__(self, window=300):
+        self.window = window
+        self.rows = collections.deque(maxlen=window)
+        self.mark = TRACER.recorded
+
+    @property
+    def columns(self):
+        return ["frame_ms", "work_ms", *self.PHASES, *self.COUNTERS]
+
+    def end_frame(self, frame_millis=None):
+        """
+        Collect the spans and counters of the frame that just ended. Without
+        `frame_millis` the frame time is the duration of its "frame" span.
+        """
+        totals = collections.Counter()
+        for name, start, end, _ in TRACER.since(self.mark):
+            totals[name] += end - start
+        self.mark = TRACER.recorded
+        counters = TRACER.take_counters()
+
+        work = totals["frame"] / 1e6
+        row = [frame_millis if frame_millis is not None else work, work]
+        for names in self.PHASES.values():
+            row.append(sum(totals[name] for name in names) / 1e6)
+        for name in self.COUNTERS:
+            row.append(counters[name])
+        self.rows.append(row)
+
+    def clear(self):
+        self.rows.clear()
+        self.mark = TRACER.recorded
+        TRACER.take_counters()
+
+    @property
+    def last(self):
+        return dict(zip(self.columns, self.rows[-1])) if self.rows else None
+
+    def fps(self):
+        if not self.rows:
+            return 0.0
+        total = sum(row[0] for row in self.rows)
+        return len(self.rows) * 1000 / total if total else 0.0
+
+    def percentiles(self, column="work_ms", q=(50, 95, 99)):
+        if not self.rows:
+            return [0.0] * len(q)
+        index = self.columns.index(column)
+        return list(numpy.percentile([row[index] for row in self.rows], q))
+
+    def means(self):
+        if not self.rows:
+            return dict.fromkeys(self.columns, 0.0)
+        return dict(zip(self.columns, numpy.mean(self.rows, axis=0)))
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(self.rows)
@@ -0,0 +1,75 @@
+import json
+
+
+class InputRecording:
+    """
+    Key presses of one run with the tick they were handled on, and what else
+    it takes to play them back identically: the RNG seed, the level files
+    or campaign manifest and the game time that passed before every tick.
+    """
+
+    VERSION = 1
+
+    def __init__(self, seed, map_filename, enemies_filename, campaign=None):
+        self.seed = seed
+        self.map_filename = map_filename
+        self.enemies_filename = enemies_filename
+        self.campaign = campaign
+        # game time advanced before each tick, in milliseconds
+        self.millis = []
+        # [tick, key] pairs in the order they were handled
+        self.keys = []
+        self.outcome = None
+
+    @property
+    def ticks(self):
+        return len(self.millis)
+
+    def begin_tick(self, millis):
+        self.millis.append(millis)
+
+    def key(self, key):
+        self.keys.append([self.ticks - 1, key])
+
+    def playback(self):
+        """Yield the game time to advance and the keys to press per tick."""
+        keys = iter(self.keys)
+        pending = next(keys, None)
+        for tick, millis in enumerate(self.millis):
+            pressed = []
+            while pending is not None and pending[0] == tick:
+                pressed.append(pending[1])
+                pending = next(keys, None)
+            yield millis, pressed
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "seed": self.seed,
+                    "map": self.map_filename,
+                    "enemies": self.enemies_filename,
+                    "campaign": self.campaign,
+                    "outcome": self.outcome,
+                    "millis": self.millis,
+                    "keys": self.keys,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+
+        if data["version"] != cls.VERSION:
+            raise ValueError(f"Unsupported recording version {data['version']}")
+
+        recording = cls(
+            data["seed"], data["map"], data["enemies"], data.get("campaign")
+        )
+        recording.millis = data["millis"]
+        recording.keys = data["keys"]
+        recording.outcome = data["outcome"]
+        return recording
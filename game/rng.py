@@ -0,0 +1,36 @@
+import hashlib
+import random
+
+
+class RandomService:
+    """
+    The game's single source of randomness.
+
+    Every subsystem draws from its own named stream derived from one seed,
+    so seeding the service makes a run reproducible, and one subsystem
+    drawing more numbers doesn't change what another one gets.
+    """
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """Start over from `seed`, or from a fresh random seed without one."""
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(32)
+        self.value = seed
+        self.streams = {}
+
+    def stream(self, name):
+        """The `random.Random` for subsystem `name`."""
+        if name not in self.streams:
+            self.streams[name] = random.Random(f"{self.value}:{name}")
+        return self.streams[name]
+
+    def derive(self, name):
+        """A stable integer seed for `name`, e.g. for a numpy generator."""
+        digest = hashlib.sha256(f"{self.value}:{name}".encode()).digest()
+        return int.from_bytes(digest[:8], "little")
+
+
+RNG = RandomService()
@@ -0,0 +1,35 @@
+import contextlib
+import time
+
+
+class StartupProfile:
+    """Wall time of each phase of starting the game, in seconds."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.phases = {}
+
+    def done(self):
+        """Mark the game as started, the end of the reported total."""
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def report(self):
+        lines = ["Startup:"]
+        for name, seconds in self.phases.items():
+            lines.append(f"  {name:<12} {seconds * 1000:8.1f} ms")
+        end = self.end if self.end is not None else time.perf_counter()
+        lines.append(f"  {'total':<12} {(end - self.start) * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+STARTUP = StartupProfile()
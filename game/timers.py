@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import logging
+
+from game.utils import post_event
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """One-shot or repeating custom event, optionally limited to some states."""
+
+    __slots__ = (
+        "custom_event",
+        "millis",
+        "repeat",
+        "states",
+        "due",
+        "remaining",
+        "seq",
+    )
+
+    def __init__(self, custom_event, millis, repeat, states):
+        self.custom_event = custom_event
+        self.millis = millis
+        self.repeat = repeat
+        self.states = states
+        # game time the timer fires at while it runs, None while it's paused
+        self.due = None
+        # time left until it fires, kept while it's paused
+        self.remaining = millis
+        # the heap entry that is current for this timer
+        self.seq = None
+
+    def runs_in(self, state):
+        return self.states is None or state in self.states
+
+
+class TimerManager:
+    """
+    Custom event timers driven by the game clock.
+
+    The owner of the game loop advances the clock every frame, by the real
+    frame time in `run` or by a fixed timestep in the headless engine, and
+    due events are posted from `advance` in the order they fell due.
+    Running timers are kept in a heap. Timers limited to some game states
+    are paused, with the time they have left, while the game is in any
+    other state, so nothing fires that no handler would see.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, state=None):
+        """
+        Drop all timers and start the clock over. `state` returns the current
+        game state for timers limited to some states.
+        """
+        self.now = 0
+        self.state = state or (lambda: None)
+        self.timers = {}
+        # (due, seq, timer) of running timers, stale entries are skipped
+        self.heap = []
+        self.counter = itertools.count()
+        self.synced = None
+
+    def start(self, custom_event, millis, repeat=True, states=None):
+        """
+        Post `custom_event` every `millis` milliseconds, or once if not
+        `repeat`, replacing any timer for the event. With `states`, time only
+        counts while the game is in one of them.
+        """
+        self.cancel(custom_event)
+        timer = Timer(custom_event, millis, repeat, states)
+        self.timers[custom_event] = timer
+        if timer.runs_in(self.synced):
+            self._resume(timer)
+        return timer
+
+    def once(self, custom_event, millis, states=None):
+        return self.start(custom_event, millis, repeat=False, states=states)
+
+    def cancel(self, custom_event):
+        timer = self.timers.pop(custom_event, None)
+        if timer is not None:
+            timer.seq = None
+
+    def until_next(self):
+        """Milliseconds until the next timer is due, or None without timers."""
+        self._sync()
+        while self.heap and self.heap[0][1] != self.heap[0][2].seq:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - self.now, 0)
+
+    def advance(self, millis):
+        self._sync()
+        self.now += millis
+
+        while self.heap and self.heap[0][0] <= self.now:
+            due, seq, timer = heapq.heappop(self.heap)
+            if seq != timer.seq:
+                continue
+
+            post_event(timer.custom_event)
+            if timer.repeat:
+                self._push(timer, due + timer.millis)
+            else:
+                del self.timers[timer.custom_event]
+                timer.seq = None
+
+    def _sync(self):
+        """Pause and resume timers if the game state changed."""
+        state = self.state()
+        if state == self.synced:
+            return
+        self.synced = state
+
+        for timer in self.timers.values():
+            running = timer.due is not None
+            if running and not timer.runs_in(state):
+                timer.remaining = timer.due - self.now
+                timer.due = None
+                timer.seq = None
+            elif not running and timer.runs_in(state):
+                self._resume(timer)
+
+    def _resume(self, timer):
+        self._push(timer, self.now + timer.remaining)
+
+    def _push(self, timer, due):
+        timer.due = due
+        timer.seq = next(self.counter)
+        heapq.heappush(self.heap, (due, timer.seq, timer))
+
+
+TIMERS = TimerManager()
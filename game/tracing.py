@@ -0,0 +1,121 @@
+import collections
+import json
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Tracer:
+    """
+    Timing spans around the phases of the game loop, kept in a fixed-size
+    ring buffer and written out in Chrome trace event format (open the file
+    in chrome://tracing or https://ui.perfetto.dev).
+
+    Besides spans, named counters (e.g. blits) can be incremented with
+    `count` and are collected by whoever reads them with `take_counters`.
+
+    While disabled, `span` returns a shared no-op context manager and
+    nothing is recorded or counted.
+    """
+
+    def __init__(self, capacity=65536):
+        self.enabled = False
+        self.capacity = capacity
+        self.origin = time.perf_counter_ns()
+        self.clear()
+
+    def clear(self):
+        # name, start and end in ns, thread id
+        self.buffer = [None] * self.capacity
+        self.next = 0
+        self.recorded = 0
+        self.counters = collections.Counter()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def take_counters(self):
+        """Return the counters and start counting from zero again."""
+        counters, self.counters = self.counters, collections.Counter()
+        return counters
+
+    def record(self, name, start, end):
+        self.buffer[self.next] = (name, start, end, threading.get_ident())
+        self.next = (self.next + 1) % self.capacity
+        self.recorded += 1
+
+    def spans(self):
+        """Recorded spans, oldest first."""
+        if self.recorded < self.capacity:
+            return self.buffer[: self.next]
+        return self.buffer[self.next :] + self.buffer[: self.next]
+
+    def since(self, mark):
+        """
+        Spans recorded after `recorded` was `mark`, oldest first, as far as
+        they are still in the buffer.
+        """
+        count = min(self.recorded - mark, self.capacity)
+        return [
+            self.buffer[(self.next - count + i) % self.capacity] for i in range(count)
+        ]
+
+    def dump(self, path):
+        """Write the spans in the buffer to `path` and return how many."""
+        pid = os.getpid()
+        spans = self.spans()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, end, tid in spans
+        ]
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+        return len(events)
+
+
+TRACER = Tracer()
@@ -1,10 +1,5 @@
-import logging
-
-import pygame
-
-logger = logging.getLogger(__name__)
+from game.events import BUS
 
 
 def post_event(custom_event, **kwargs):
-    pygame.event.post(pygame.event.Event(custom_event.value, **kwargs))
-    logger.debug("Posted event %s", custom_event)
+    BUS.post(custom_event, **kwargs)
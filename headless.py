@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from game.headless import main
+
+main()